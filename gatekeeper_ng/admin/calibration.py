@@ -0,0 +1,74 @@
+import array
+import bisect
+import collections
+import math
+import threading
+from statistics import fmean
+
+class CalibrationSession:
+    """
+    RSSI readings collected for one satellite calibration run.
+
+    Running sums over the last `window` readings make the stability check
+    O(1) per poll, and a sorted copy of the readings (kept with insort)
+    lets the trimmed mean be sliced without sorting. RSSI values are whole
+    dBm, so the sorted copy is a compact int16 array.
+    """
+    def __init__(self, start, window=30, max_readings=512):
+        self.start = start
+        self.lock = threading.Lock()
+
+        # All readings (bounded) + their sorted view and running total
+        self.readings = collections.deque(maxlen=max_readings)
+        self.sorted_readings = array.array('h')
+        self.total = 0
+
+        # Rolling stability window
+        self.window = collections.deque(maxlen=window)
+        self.window_sum = 0
+        self.window_sumsq = 0
+
+    def add(self, rssi):
+        rssi = int(rssi)
+        if len(self.readings) == self.readings.maxlen:
+            old = self.readings[0]
+            self.total -= old
+            del self.sorted_readings[bisect.bisect_left(self.sorted_readings, old)]
+        self.readings.append(rssi)
+        self.total += rssi
+        bisect.insort(self.sorted_readings, rssi)
+
+        if len(self.window) == self.window.maxlen:
+            old = self.window[0]
+            self.window_sum -= old
+            self.window_sumsq -= old * old
+        self.window.append(rssi)
+        self.window_sum += rssi
+        self.window_sumsq += rssi * rssi
+
+    @property
+    def count(self):
+        return len(self.readings)
+
+    def window_full(self):
+        return len(self.window) == self.window.maxlen
+
+    def window_stdev(self):
+        """Sample standard deviation of the rolling window."""
+        n = len(self.window)
+        if n < 2:
+            return 0.0
+        var = (self.window_sumsq - self.window_sum * self.window_sum / n) / (n - 1)
+        return math.sqrt(max(0.0, var))
+
+    def mean(self):
+        return self.total / len(self.readings)
+
+    def trimmed_mean(self, proportion=0.1):
+        """Mean after dropping `proportion` of readings at each end (None if nothing is left)."""
+        vals = self.sorted_readings
+        trim = max(1, int(len(vals) * proportion))
+        trimmed_vals = vals[trim:-trim]
+        if not trimmed_vals:
+            return None
+        return fmean(trimmed_vals)
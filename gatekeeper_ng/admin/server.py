@@ -1,82 +1,284 @@
-from flask import Flask, render_template, request, redirect, url_for, flash
+from flask import (Flask, Response, render_template, stream_template, request, redirect,
+                   url_for, flash, get_flashed_messages, session)
+from flask.json.provider import DefaultJSONProvider
+import asyncio
 import logging
 import os
-import json
 import threading
 import time
+import traceback
+from functools import lru_cache
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    from waitress import serve
+except ImportError:
+    serve = None
 
 # We import ConfigManager from app to reuse logic
 from app.config_mgr import ConfigManager
+from app.ble_scanner import parse_interval
+from admin.calibration import CalibrationSession
+
+DEVICES_SNAPSHOT_TTL = 1.0  # seconds
+CALIB_SESSION_TTL = 600  # seconds
+RELOAD_DEBOUNCE = 0.5  # seconds
+
+# Part of every page ETag so a restart (e.g. new templates) invalidates them
+_BOOT_ID = os.urandom(4).hex()
+
+LOG_FILE = '/home/rpi/gatekeeper.log'
+
+def _tail_lines(path, count, exclude=None, chunk_size=64 * 1024):
+    """
+    Returns the last `count` lines of a file, skipping lines that contain
+    `exclude`. Reads backwards from the end in chunks, so the cost depends
+    on the size of the tail rather than the size of the file.
+    """
+    lines = []
+    with open(path, 'rb') as f:
+        pos = f.seek(0, os.SEEK_END)
+        partial = b''
+        first = True
+        while pos > 0 and len(lines) < count:
+            step = min(chunk_size, pos)
+            pos -= step
+            f.seek(pos)
+            pieces = (f.read(step) + partial).split(b'\n')
+            if first:
+                if pieces[-1] == b'':
+                    pieces.pop() # Trailing newline
+                first = False
+            # The first piece may continue in the previous chunk
+            partial = pieces.pop(0) if pos else b''
+            for raw in reversed(pieces):
+                line = raw.decode('utf-8', 'replace')
+                if exclude and exclude in line:
+                    continue
+                lines.append(line)
+                if len(lines) == count:
+                    break
+    lines.reverse()
+    return lines
+
+@lru_cache(maxsize=256)
+def _fmt_uptime(sec):
+    """Formats a satellite uptime given in whole seconds."""
+    if sec < 60: return f"{sec}s"
+    if sec < 3600: return f"{sec // 60}m"
+    if sec < 86400: return f"{sec // 3600}h {sec % 3600 // 60}m"
+    return f"{sec // 86400}d {sec % 86400 // 3600}h"
+
+def _uptime_text(raw_uptime):
+    try:
+        return _fmt_uptime(int(float(raw_uptime)))
+    except (ValueError, TypeError, OverflowError):
+        return "--"
+
+@lru_cache(maxsize=256)
+def _fmt_last_seen(diff):
+    """Formats a satellite last-seen delta given in whole seconds."""
+    if diff < 60: return f"Just now ({diff}s ago)"
+    if diff < 3600: return f"{diff//60}m ago"
+    return f"{diff//3600}h ago"
+
+def _age_filter(last, now):
+    """Template filter: {{ info.last_seen|age(now) }}"""
+    return _fmt_last_seen(int(now - last))
+
+class OrjsonProvider(DefaultJSONProvider):
+    """Flask JSON provider using orjson when installed; compact, keys unsorted."""
+    sort_keys = False
+    compact = True
+
+    def dumps(self, obj, **kwargs):
+        if orjson and not kwargs:
+            return orjson.dumps(obj).decode()
+        return super().dumps(obj, **kwargs)
+
+    def loads(self, s, **kwargs):
+        if orjson and not kwargs:
+            return orjson.loads(s)
+        return super().loads(s, **kwargs)
+
+    def response(self, *args, **kwargs):
+        if not orjson:
+            return super().response(*args, **kwargs)
+        obj = self._prepare_response_obj(args, kwargs)
+        return self._app.response_class(orjson.dumps(obj), mimetype=self.mimetype)
+
+_HEALTH_BODY = b'{"status":"ok"}'
+_HEALTH_HEADERS = [('Content-Type', 'application/json'),
+                   ('Content-Length', str(len(_HEALTH_BODY)))]
+
+def _health_middleware(wsgi_app):
+    """Answers /health before Flask routing so liveness checks stay cheap."""
+    def app(environ, start_response):
+        if environ.get('PATH_INFO') == '/health':
+            start_response('200 OK', _HEALTH_HEADERS)
+            return [_HEALTH_BODY]
+        return wsgi_app(environ, start_response)
+    return app
 
 class WebAdmin:
+    # (rule, endpoint/handler method, HTTP methods)
+    _ROUTES = (
+        ('/', 'dashboard', None),
+        ('/api/devices', 'api_devices', None),
+        ('/devices', 'manage_devices', None),
+        ('/devices/add', 'add_device', ('POST',)),
+        ('/devices/edit', 'edit_device', ('POST',)),
+        ('/devices/delete', 'delete_device', ('POST',)),
+        ('/devices/announce', 'announce_devices', ('POST',)),
+        ('/mqtt', 'manage_mqtt', None),
+        ('/mqtt/save', 'save_mqtt', ('POST',)),
+        ('/preferences', 'manage_preferences', None),
+        ('/preferences/save', 'save_preferences', ('POST',)),
+        ('/bluetooth', 'bluetooth_tools', None),
+        ('/bluetooth/scan', 'bluetooth_scan_api', ('GET', 'POST')),
+        ('/bluetooth/clear', 'bluetooth_clear', ('POST',)),
+        ('/satellites', 'manage_satellites', None),
+        ('/satellites/update', 'update_satellite', ('POST',)),
+        ('/satellites/calibrate', 'calibrate_satellite', ('GET',)),
+        ('/satellites/update_ref', 'update_satellite_ref', ('POST',)),
+        ('/api/satellites', 'api_satellites', None),
+        ('/logs', 'view_logs', None),
+        ('/logs/raw', 'view_logs_raw', None),
+        ('/restart', 'restart_service', ('POST',)),
+    )
+
     def __init__(self, config_mgr, tracker=None, scanner=None, host='0.0.0.0', port=80):
         self.app = Flask(__name__, template_folder='templates')
         self.app.secret_key = 'gatekeeper_secret_ng'
+        self.app.json = OrjsonProvider(self.app)
+        # Templates only change on deploy: compile once, never re-stat on render
+        self.app.config['TEMPLATES_AUTO_RELOAD'] = False
+        self.app.jinja_env.auto_reload = False
+        self.app.add_template_filter(_age_filter, 'age')
+        # Compile every template now rather than on the first request for each page
+        for name in self.app.jinja_env.list_templates(extensions=['html']):
+            self.app.jinja_env.get_template(name)
+        self.app.wsgi_app = _health_middleware(self.app.wsgi_app)
         self.config_mgr = config_mgr
         self.tracker = tracker
         self.scanner = scanner
         self.host = host
         self.port = port
         self.logger = logging.getLogger("WebAdmin")
-
-        # Register Routes
-        self.app.add_url_rule('/', 'dashboard', self.dashboard)
-        self.app.add_url_rule('/health', 'health', self.health)
-        self.app.add_url_rule('/api/devices', 'api_devices', self.api_devices)
-        self.app.add_url_rule('/devices', 'manage_devices', self.manage_devices)
-        self.app.add_url_rule('/devices/add', 'add_device', self.add_device, methods=['POST'])
-        self.app.add_url_rule('/devices/edit', 'edit_device', self.edit_device, methods=['POST'])
-        self.app.add_url_rule('/devices/delete', 'delete_device', self.delete_device, methods=['POST'])
-        self.app.add_url_rule('/devices/announce', 'announce_devices', self.announce_devices, methods=['POST'])
-        self.app.add_url_rule('/mqtt', 'manage_mqtt', self.manage_mqtt)
-        self.app.add_url_rule('/mqtt/save', 'save_mqtt', self.save_mqtt, methods=['POST'])
-        self.app.add_url_rule('/preferences', 'manage_preferences', self.manage_preferences)
-        self.app.add_url_rule('/preferences/save', 'save_preferences', self.save_preferences, methods=['POST'])
-        self.app.add_url_rule('/bluetooth', 'bluetooth_tools', self.bluetooth_tools)
-        self.app.add_url_rule('/bluetooth/scan', 'bluetooth_scan_api', self.bluetooth_scan_api, methods=['POST'])
-        self.app.add_url_rule('/bluetooth/clear', 'bluetooth_clear', self.bluetooth_clear, methods=['POST'])
-        self.app.add_url_rule('/satellites', 'manage_satellites', self.manage_satellites)
-        self.app.add_url_rule('/satellites/update', 'update_satellite', self.update_satellite, methods=['POST'])
-        self.app.add_url_rule('/satellites/calibrate', 'calibrate_satellite', self.calibrate_satellite, methods=['GET'])
-        self.app.add_url_rule('/satellites/update_ref', 'update_satellite_ref', self.update_satellite_ref, methods=['POST'])
-        self.app.add_url_rule('/api/satellites', 'api_satellites', self.api_satellites)
-        self.app.add_url_rule('/logs', 'view_logs', self.view_logs)
-        self.app.add_url_rule('/restart', 'restart_service', self.restart_service, methods=['POST'])
+        # (built_at, device rows) shared by concurrent dashboard polls
+        self._devices_snapshot = (0.0, [])
+        # Calibration State: satellite id -> CalibrationSession
+        self._calib_sessions = {}
+        self._calib_lock = threading.Lock()
+        # (log file etag, tail lines) from the last /logs/raw read
+        self._log_cache = (None, [])
+        # Views derived from one config file: name -> (file stamp, value)
+        self._view_cache = {}
+        # Pending debounced tracker reload
+        self._reload_timer = None
+        self._reload_lock = threading.Lock()
+
+        # Register Routes ('/devices/' serves the same view instead of redirecting)
+        self.app.url_map.strict_slashes = False
+        for rule, endpoint, methods in self._ROUTES:
+            self.app.add_url_rule(rule, endpoint, getattr(self, endpoint), methods=methods)
 
     def run_server(self):
         self.logger.info(f"Starting Web Admin on port {self.port}")
-        # Disable Flask banner to keep logs clean
-        cli = list(self.app.logger.handlers) 
-        for h in cli: self.app.logger.removeHandler(h)
-        
-        self.app.run(host=self.host, port=self.port, debug=False, use_reloader=False)
+        if serve:
+            # Thread pool + keep-alive so dashboard/calibration polls run concurrently
+            serve(self.app, host=self.host, port=self.port, threads=8,
+                  channel_timeout=30, connection_limit=64)
+        else:
+            self.logger.warning("waitress not installed, using Flask development server")
+            # Disable Flask banner to keep logs clean
+            cli = list(self.app.logger.handlers) 
+            for h in cli: self.app.logger.removeHandler(h)
+            self.app.run(host=self.host, port=self.port, debug=False, use_reloader=False, threaded=True)
 
     def start(self):
         t = threading.Thread(target=self.run_server, daemon=True)
         t.start()
         
+    def _schedule_reload(self):
+        """Reload tracker config once saves have been quiet for RELOAD_DEBOUNCE."""
+        if not self.tracker:
+            return
+        with self._reload_lock:
+            if self._reload_timer:
+                self._reload_timer.cancel()
+            self._reload_timer = threading.Timer(RELOAD_DEBOUNCE, self.tracker.reload_config)
+            self._reload_timer.daemon = True
+            self._reload_timer.start()
+
+    def _config_page(self, paths, render):
+        """
+        Renders a page built only from the given config files, answering 304
+        while none of them changed. Pages with pending flashes always render.
+        """
+        if session.get('_flashes'):
+            return render()
+        stamps = [self.config_mgr.file_stamp(p) for p in paths]
+        etag = _BOOT_ID + '-' + '-'.join('.'.join(f"{v:x}" for v in s) if s else '0' for s in stamps)
+        if request.if_none_match.contains(etag):
+            return Response(status=304, headers={'ETag': f'"{etag}"', 'Cache-Control': 'no-cache'})
+        resp = self.app.make_response(render())
+        resp.set_etag(etag)
+        resp.headers['Cache-Control'] = 'no-cache'
+        return resp
+
+    def _cached_view(self, name, path, build):
+        """Returns build() memoized until the config file at path changes."""
+        stamp = self.config_mgr.file_stamp(path)
+        hit = self._view_cache.get(name)
+        if hit and hit[0] == stamp:
+            return hit[1]
+        value = build()
+        self._view_cache[name] = (stamp, value)
+        return value
+
+    def _satellite_names(self):
+        """Satellite id -> room name, including the Hub as a virtual satellite."""
+        def build():
+            names = {sid: sdata.get('room', sid) for sid, sdata in self.config_mgr.load_satellites().items()}
+            names['gatekeeper-hub'] = 'SalaTV-Cocina'
+            return names
+        return self._cached_view('sat_names', self.config_mgr.satellites_file, build)
+
+    def _json_response(self, data):
+        return self.app.json.response(data)
+
     # --- ROUTES ---
 
-    def health(self):
-        return json.dumps({"status": "ok"})
-        
     def api_devices(self):
         """API Endpoint for Real-time Dashboard Updates"""
-        devices = self.config_mgr.load_devices()
+        # Every open dashboard polls this; merge tracker state at most once per
+        # TTL and publish the rows by swapping the whole tuple.
+        now = time.time()
+        built_at, result = self._devices_snapshot
+        if now - built_at >= DEVICES_SNAPSHOT_TTL:
+            result = self._build_device_rows(now)
+            self._devices_snapshot = (now, result)
+        return self._json_response(result)
+
+    def _build_device_rows(self, now):
+        devices = self.config_mgr.device_index()
         result = []
         
         if self.tracker:
-            now = time.time()
-            for d in devices:
-                key = d.get('identifier', d.get('mac'))
-                if d.get('identifier_type') == 'mac' or not d.get('identifier_type'):
-                     key = key.upper()
-                     
-                state = self.tracker.current_state.get(key)
+            # Loop invariants bound to locals
+            get_state = self.tracker.current_state.get
+            append = result.append
+            for key, d in devices.items():
+                state = get_state(key)
                 
                 item = {
                     'alias': d['alias'],
-                    'mac': d.get('mac', key),
+                    'mac': key,
                     'room': 'Unknown',
                     'distance': '-',
                     'last_seen_fmt': 'No data',
@@ -101,9 +303,9 @@ class WebAdmin:
                         elif diff > 3600: item['last_seen_fmt'] = f"{diff // 3600}h ago"
                         else: item['last_seen_fmt'] = f"{diff // 60}m ago"
                         
-                result.append(item)
+                append(item)
                 
-        return json.dumps(result)
+        return result
 
     def dashboard(self):
         # We render the template with initial data, JS handles polling
@@ -111,8 +313,12 @@ class WebAdmin:
                              service_active=True)
 
     def manage_devices(self):
-        devices = self.config_mgr.load_devices()
-        return render_template('devices.html', devices=devices)
+        def render():
+            devices = self.config_mgr.load_devices()
+            # Pop flashes now so the session cookie is final before the body streams
+            get_flashed_messages()
+            return Response(stream_template('devices.html', devices=devices), mimetype='text/html')
+        return self._config_page((self.config_mgr.devices_file,), render)
 
     def add_device(self):
         identifier = request.form.get('identifier', '').strip()
@@ -125,21 +331,19 @@ class WebAdmin:
             identifier = request.form.get('mac', '').strip()
             identifier_type = 'mac'
             
-        if identifier_type == 'mac':
-            identifier = identifier.upper()
+        # Identifiers are stored uppercase (MACs and iBeacon UUIDs alike)
+        identifier = identifier.upper()
 
         self.logger.info(f"Adding device request: {identifier} ({alias})")
         
         if identifier and alias:
-            devices = self.config_mgr.load_devices()
             # Check for duplicates
-            for d in devices:
-                existing = d.get('identifier', d.get('mac', '')).strip().upper()
-                if existing == identifier:
-                    self.logger.warning(f"Device {identifier} already exists")
-                    flash('Device already exists')
-                    return redirect(url_for('manage_devices'))
+            if identifier in self.config_mgr.known_identifiers():
+                self.logger.warning(f"Device {identifier} already exists")
+                flash('Device already exists')
+                return redirect(url_for('manage_devices'))
             
+            devices = self.config_mgr.load_devices()
             new_device = {
                 'identifier': identifier,
                 'identifier_type': identifier_type,
@@ -150,8 +354,7 @@ class WebAdmin:
             devices.append(new_device)
             self.config_mgr.save_devices(devices)
             
-            if self.tracker:
-                self.tracker.reload_config()
+            self._schedule_reload()
             
             self.logger.info(f"Successfully added device {alias}")
             flash(f'Added {alias}')
@@ -168,16 +371,10 @@ class WebAdmin:
              flash('No device specified')
              return redirect(url_for('manage_devices'))
 
-        devices = self.config_mgr.load_devices()
-        initial_count = len(devices)
-        
-        # Filter out the device (case insensitive check)
-        new_list = [d for d in devices if d.get('identifier', d.get('mac', '')).strip().upper() != target.upper()]
-        
-        if len(new_list) < initial_count:
-            self.config_mgr.save_devices(new_list)
-            if self.tracker:
-                self.tracker.reload_config()
+        index = self.config_mgr.device_index()
+        if index.pop(target.upper(), None) is not None:
+            self.config_mgr.save_devices(list(index.values()))
+            self._schedule_reload()
             self.logger.info(f"Deleted device {target}")
             flash('Device deleted')
         else:
@@ -197,29 +394,22 @@ class WebAdmin:
             flash('Missing required fields')
             return redirect(url_for('manage_devices'))
             
-        if id_type == 'mac':
-            new_id = new_id.upper()
+        new_id = new_id.upper()
 
         self.logger.info(f"Editing device {original_id} -> {new_id} ({new_alias})")
 
-        devices = self.config_mgr.load_devices()
-        updated = False
-        for i, d in enumerate(devices):
-            ident = d.get('identifier', d.get('mac', '')).strip()
-            if ident.upper() == original_id.upper():
-                devices[i] = {
-                    'identifier': new_id,
-                    'identifier_type': id_type,
-                    'alias': new_alias,
-                    'type': new_type
-                }
-                updated = True
-                break
-        
-        if updated:
-            self.config_mgr.save_devices(devices)
-            if self.tracker:
-                self.tracker.reload_config()
+        index = self.config_mgr.device_index()
+        key = original_id.upper()
+        if key in index:
+            # Replace in place so the device keeps its position in the file
+            index[key] = {
+                'identifier': new_id,
+                'identifier_type': id_type,
+                'alias': new_alias,
+                'type': new_type
+            }
+            self.config_mgr.save_devices(list(index.values()))
+            self._schedule_reload()
             self.logger.info(f"Successfully updated {new_alias}")
             flash(f'Updated {new_alias}')
         else:
@@ -234,8 +424,6 @@ class WebAdmin:
                 flash('MQTT not connected or tracker missing')
                 return redirect(url_for('manage_devices'))
                 
-            import asyncio
-            import traceback
             devices = self.config_mgr.load_devices()
             
             loop = getattr(self.tracker.mqtt_client, 'loop', None)
@@ -250,23 +438,26 @@ class WebAdmin:
                 flash('System loop not ready. Try again in a moment.')
                 
         except Exception as e:
-            import traceback
             self.logger.error(f"Error in announce_devices: {e}\n{traceback.format_exc()}")
             flash(f"Error: {str(e)}")
             
         return redirect(url_for('manage_devices'))
 
     def manage_mqtt(self):
-        prefs = self.config_mgr.load_mqtt()
-        view_prefs = {
-            'mqtt_address': prefs.get('broker'),
-            'mqtt_port': prefs.get('port'),
-            'mqtt_user': prefs.get('user'),
-            'mqtt_password': prefs.get('password'),
-            'mqtt_topicpath': prefs.get('topic_prefix'),
-            'mqtt_publisher_identity': 'gatekeeper'
-        }
-        return render_template('mqtt.html', prefs=view_prefs)
+        def build():
+            prefs = self.config_mgr.load_mqtt()
+            return {
+                'mqtt_address': prefs.get('broker'),
+                'mqtt_port': prefs.get('port'),
+                'mqtt_user': prefs.get('user'),
+                'mqtt_password': prefs.get('password'),
+                'mqtt_topicpath': prefs.get('topic_prefix'),
+                'mqtt_publisher_identity': 'gatekeeper'
+            }
+        def render():
+            view_prefs = self._cached_view('mqtt', self.config_mgr.mqtt_file, build)
+            return render_template('mqtt.html', prefs=view_prefs)
+        return self._config_page((self.config_mgr.mqtt_file,), render)
 
     def save_mqtt(self):
         data = request.form
@@ -278,205 +469,164 @@ class WebAdmin:
             "topic_prefix": data.get('mqtt_topicpath')
         }
         
-        mqtt_file = self.config_mgr.mqtt_file
-        try:
-            tmp_path = mqtt_file + ".tmp"
-            with open(tmp_path, 'w') as f:
-                json.dump(new_conf, f, indent=4)
-                f.flush()
-                os.fsync(f.fileno())
-            os.replace(tmp_path, mqtt_file)
+        if self.config_mgr.save_mqtt(new_conf):
             flash('MQTT Saved. Please Restart.')
-        except Exception as e:
-            flash(f"Error: {e}")
+        else:
+            flash('Error saving MQTT settings')
             
         return redirect(url_for('manage_mqtt'))
 
     def manage_preferences(self):
-        prefs = self.config_mgr.load_settings()
-        return render_template('preferences.html', prefs=prefs)
+        def render():
+            prefs = self.config_mgr.load_settings()
+            return render_template('preferences.html', prefs=prefs)
+        return self._config_page((self.config_mgr.settings_file,), render)
 
     def save_preferences(self):
-        new_prefs = {k: v for k, v in request.form.items()}
-        if 'PREF_DEVICE_TRACKER_REPORT' not in new_prefs: new_prefs['PREF_DEVICE_TRACKER_REPORT'] = 'false'
-        if 'PREF_ENABLE_LOGGING' not in new_prefs: new_prefs['PREF_ENABLE_LOGGING'] = 'false'
+        new_prefs = request.form.to_dict(flat=True)
+        # Unchecked checkboxes are not submitted
+        new_prefs.setdefault('PREF_DEVICE_TRACKER_REPORT', 'false')
+        new_prefs.setdefault('PREF_ENABLE_LOGGING', 'false')
         
         self.config_mgr.save_settings(new_prefs)
+        if self.scanner:
+            self.scanner.min_adv_interval = parse_interval(new_prefs.get('PREF_MIN_ADV_INTERVAL'))
         
-        if self.tracker:
-            self.tracker.reload_config()
+        self._schedule_reload()
             
         flash('Preferences Saved.')
         return redirect(url_for('manage_preferences'))
 
     def bluetooth_tools(self):
-        satellites = self.config_mgr.load_satellites()
-        # Add the Hub as a virtual satellite for the UI
-        sat_list = [{"id": "gatekeeper-hub", "name": "SalaTV-Cocina"}]
-        for sid, sdata in satellites.items():
-            sat_list.append({"id": sid, "name": sdata.get('room', sid)})
-        return render_template('bluetooth.html', scan_results=[], satellites=sat_list)
+        def build():
+            names = self._satellite_names()
+            # The Hub (virtual satellite) is listed first for the UI
+            sat_list = [{"id": "gatekeeper-hub", "name": names['gatekeeper-hub']}]
+            sat_list += [{"id": sid, "name": name} for sid, name in names.items() if sid != 'gatekeeper-hub']
+            return sat_list
+        def render():
+            sat_list = self._cached_view('sat_list', self.config_mgr.satellites_file, build)
+            return render_template('bluetooth.html', scan_results=[], satellites=sat_list)
+        return self._config_page((self.config_mgr.satellites_file,), render)
     
     def bluetooth_scan_api(self):
-        known_identifiers = set()
-        if self.config_mgr:
-            devices = self.config_mgr.load_devices()
-            for d in devices:
-                ident = d.get('identifier', d.get('mac', '')).strip()
-                if d.get('identifier_type') == 'mac' or not d.get('identifier_type'):
-                    known_identifiers.add(ident.upper())
-                else:
-                    known_identifiers.add(ident)
+        known_identifiers = self.config_mgr.known_identifiers() if self.config_mgr else frozenset()
         
-        # Load satellite mapping for room names
-        satellites = self.config_mgr.load_satellites()
+        sat_names = self._satellite_names()
         
         results = []
-        now = time.time()
+        append = results.append
         
         # 1. From Discovery Cache (Satellites + Hub)
-        if self.tracker and hasattr(self.tracker, 'discovery_cache'):
-            for ident, data in list(self.tracker.discovery_cache.items()):
-                if now - data.get('last_seen', 0) < 60:
-                    is_ibeacon = '-' in ident and len(ident) == 36
-                    
-                    # Convert satellite IDs to Names + RSSI
-                    raw_sources = data.get('sources', {}) # Dict {sid: rssi}
-                    named_sources_detailed = []
-                    for sid, srssi in raw_sources.items():
-                        if sid == 'gatekeeper-hub':
-                            name = 'SalaTV-Cocina'
-                            source_id = 'gatekeeper-hub'
-                        else:
-                            name = satellites.get(sid, {}).get('room', sid)
-                            source_id = sid
-                        named_sources_detailed.append({
-                            'id': source_id,
-                            'name': name, 
-                            'rssi': srssi
-                        })
-                            
-                    results.append({
-                        'type': 'ibeacon' if is_ibeacon else 'ble',
-                        'identifier': ident,
-                        'uuid_short': ident[:8] + '...' + ident[-4:] if is_ibeacon else ident,
-                        'uuid_full': ident if is_ibeacon else ident,
-                        'mac': ident if not is_ibeacon else None,
-                        'rssi': data.get('rssi', -100),
-                        'major': data.get('major'),
-                        'minor': data.get('minor'),
-                        'name': data.get('name') or (f"iBeacon {data.get('major')}/{data.get('minor')}" if is_ibeacon else "Unknown"),
-                        'tracked': ident.upper() in known_identifiers if not is_ibeacon else ident in known_identifiers,
-                        'sources_detailed': named_sources_detailed
-                    })
-        
+        if self.tracker:
+            for ident, data in self.tracker.recent_discoveries(60):
+                is_ibeacon = '-' in ident and len(ident) == 36
+                
+                # Convert satellite IDs to Names + RSSI
+                raw_sources = data.get('sources', {}) # Dict {sid: rssi}
+                named_sources_detailed = [
+                    {'id': sid, 'name': sat_names.get(sid, sid), 'rssi': srssi}
+                    for sid, srssi in raw_sources.items()
+                ]
+                        
+                append({
+                    'type': 'ibeacon' if is_ibeacon else 'ble',
+                    'identifier': ident,
+                    'uuid_short': ident[:8] + '...' + ident[-4:] if is_ibeacon else ident,
+                    'uuid_full': ident if is_ibeacon else ident,
+                    'mac': ident if not is_ibeacon else None,
+                    'rssi': data.get('rssi', -100),
+                    'major': data.get('major'),
+                    'minor': data.get('minor'),
+                    'name': data.get('name') or (f"iBeacon {data.get('major')}/{data.get('minor')}" if is_ibeacon else "Unknown"),
+                    'tracked': ident in known_identifiers,
+                    'sources_detailed': named_sources_detailed
+                })
+    
         # 2. Add anything from local scanner that might be missing
         if self.scanner:
             found = self.scanner.get_recent_devices(seconds=30)
             seen_idents = {r['identifier'] for r in results}
             for d in found:
                 if d['mac'] not in seen_idents:
-                    results.append({
+                    append({
                         'type': 'ble',
                         'identifier': d['mac'],
                         'mac': d['mac'],
                         'name': d.get('name', 'Unknown'),
                         'rssi': d.get('rssi', -100),
-                        'tracked': d['mac'].upper() in known_identifiers,
+                        'tracked': d['mac'] in known_identifiers,
                         'sources_detailed': [{'id': 'gatekeeper-hub', 'name': 'SalaTV-Cocina', 'rssi': d.get('rssi', -100)}]
                     })
         
         # Sort by RSSI Descending (Strongest first)
         results.sort(key=lambda x: x.get('rssi', -100), reverse=True)
         
-        return json.dumps({"results": results})
+        # Polled every 2s: answer 304 when nothing changed since the last poll
+        resp = self._json_response({"results": results})
+        resp.add_etag()
+        resp.headers['Cache-Control'] = 'no-cache'
+        return resp.make_conditional(request)
 
     def bluetooth_clear(self):
         if self.tracker:
             self.tracker.clear_discovery_cache()
-        return json.dumps({"status": "cleared"})
+        return self._json_response({"status": "cleared"})
 
     def manage_satellites(self):
         satellites = self.config_mgr.load_satellites()
         now = time.time()
+        get_stats = self.tracker.satellite_stats.get
+        views = {}
         for sid, info in satellites.items():
             # Add health stats if available
-            stats = self.tracker.satellite_stats.get(sid, {})
-            info['wifi_signal'] = stats.get('wifi_signal', '--')
-            info['wifi_signal'] = stats.get('wifi_signal', '--')
-            
+            stats = get_stats(sid, {})
             raw_uptime = stats.get('uptime', 0)
-            info['uptime'] = raw_uptime
-            
-            try:
-                up_sec = float(raw_uptime)
-                if up_sec < 60:
-                    info['uptime_fmt'] = f"{int(up_sec)}s"
-                elif up_sec < 3600:
-                    info['uptime_fmt'] = f"{int(up_sec/60)}m"
-                elif up_sec < 86400:
-                    info['uptime_fmt'] = f"{int(up_sec/3600)}h {int((up_sec%3600)/60)}m"
-                else:
-                    info['uptime_fmt'] = f"{int(up_sec/86400)}d {int((up_sec%86400)/3600)}h"
-            except (ValueError, TypeError):
-                info['uptime_fmt'] = "--"
-            
-            last = info.get('last_seen', 0)
-            diff = int(now - last)
-            if diff < 60:
-                info['last_seen_fmt'] = f"Just now ({diff}s ago)"
-            elif diff < 3600:
-                info['last_seen_fmt'] = f"{diff//60}m ago"
-            else:
-                info['last_seen_fmt'] = f"{diff//3600}h ago"
+            views[sid] = {
+                **info,
+                'wifi_signal': stats.get('wifi_signal', '--'),
+                'uptime': raw_uptime,
+                'uptime_fmt': _uptime_text(raw_uptime),
+            }
                 
-        return render_template('satellites.html', satellites=satellites)
+        return render_template('satellites.html', satellites=views, now=now)
 
     def api_satellites(self):
         """API Endpoint for Real-time Satellite Stats"""
         satellites = self.config_mgr.load_satellites()
         now = time.time()
+        get_stats = self.tracker.satellite_stats.get
         results = {}
         
         for sid, info in satellites.items():
             # Get fresh stats from memory
-            stats = self.tracker.satellite_stats.get(sid, {})
-            
-            # Format Uptime
-            raw_uptime = stats.get('uptime', 0)
-            uptime_fmt = "--"
-            try:
-                up_sec = float(raw_uptime)
-                if up_sec < 60: uptime_fmt = f"{int(up_sec)}s"
-                elif up_sec < 3600: uptime_fmt = f"{int(up_sec/60)}m"
-                elif up_sec < 86400: uptime_fmt = f"{int(up_sec/3600)}h {int((up_sec%3600)/60)}m"
-                else: uptime_fmt = f"{int(up_sec/86400)}d {int((up_sec%86400)/3600)}h"
-            except: pass
-            
-            # Format Last Seen
-            last = info.get('last_seen', 0)
-            diff = int(now - last)
-            if diff < 60: last_seen_fmt = f"Just now ({diff}s ago)"
-            elif diff < 3600: last_seen_fmt = f"{diff//60}m ago"
-            else: last_seen_fmt = f"{diff//3600}h ago"
+            stats = get_stats(sid, {})
+            diff = int(now - info.get('last_seen', 0))
             
             results[sid] = {
                 'wifi_signal': stats.get('wifi_signal', '--'),
-                'uptime_fmt': uptime_fmt,
-                'last_seen_fmt': last_seen_fmt,
+                'uptime_fmt': _uptime_text(stats.get('uptime', 0)),
+                'last_seen_fmt': _fmt_last_seen(diff),
                 'is_online': diff < 60 # Flag for UI highlighting
             }
             
-        return json.dumps(results)
+        return self._json_response(results)
 
     def update_satellite(self):
         sats = self.config_mgr.load_satellites()
         updated = False
         
-        for sid in sats.keys():
-            room = request.form.get(f'room_{sid}', '').strip()
-            x = request.form.get(f'x_{sid}', '0')
-            y = request.form.get(f'y_{sid}', '0')
+        # One pass over the form: room_<sid>, x_<sid>, y_<sid> -> {sid: {field: value}}
+        fields = {}
+        for key, value in request.form.items():
+            field, _, sid = key.partition('_')
+            if field in ('room', 'x', 'y') and sid in sats:
+                fields.setdefault(sid, {})[field] = value
+        
+        for sid, form in fields.items():
+            room = form.get('room', '').strip()
+            x = form.get('x', '0')
+            y = form.get('y', '0')
             
             if room:
                 sats[sid]['room'] = room
@@ -512,64 +662,66 @@ class WebAdmin:
                 flash("Satellite not found")
         return redirect(url_for('manage_satellites'))
 
-    # Calibration State
-    _calib_sessions = {}
-
     def calibrate_satellite(self):
         sid = request.args.get('satellite')
         action = request.args.get('action')
         
         if not sid: 
-            return json.dumps({'error': 'No satellite ID'})
+            return self._json_response({'error': 'No satellite ID'})
 
         now = time.time()
         
         if action == 'start':
-            self._calib_sessions[sid] = {'start': now, 'readings': []}
-            return json.dumps({'status': 'started', 'satellite': sid})
+            with self._calib_lock:
+                # Drop sessions abandoned mid-run so the map stays bounded
+                self._calib_sessions = {k: s for k, s in self._calib_sessions.items()
+                                        if now - s.start < CALIB_SESSION_TTL}
+                self._calib_sessions[sid] = CalibrationSession(now)
+            return self._json_response({'status': 'started', 'satellite': sid})
             
         elif action == 'status':
-            session = self._calib_sessions.get(sid)
-            if not session:
-                return json.dumps({'error': 'No session'})
+            with self._calib_lock:
+                calib = self._calib_sessions.get(sid)
+            if not calib:
+                return self._json_response({'error': 'No session'})
             
-            elapsed = now - session['start']
+            elapsed = now - calib.start
             
-            last_rssi = None
+            # Snapshot once: the tracker replaces this entry from its own thread
+            sig_data = None
             if self.tracker:
                 sig_data = getattr(self.tracker, 'last_sat_signals', {}).get(sid)
+
+            with calib.lock:
+                last_rssi = None
                 # Allow data up to 10s old (Satellite keepalive is 5s)
                 if sig_data and (now - sig_data['time']) < 10:
                     last_rssi = sig_data['rssi']
-                    session['readings'].append(last_rssi)
+                    calib.add(last_rssi)
 
-            import statistics
-            is_stable = False
-            progress = 0
-            count = len(session['readings'])
-            
-            if count >= 30:
-                std_dev = statistics.stdev(session['readings'][-30:])
-                if std_dev < 2.0 and elapsed > 15:
-                    is_stable = True
-            
-            if elapsed >= 45:
-                is_stable = True
+                is_stable = False
+                progress = 0
+                count = calib.count
                 
-            progress = min(99, int((elapsed / 25.0) * 100))
-            if is_stable: progress = 100
-
-            avg_rssi = -100
-            if progress == 100 and count > 10:
-                vals = sorted(session['readings'])
-                trim = max(1, int(len(vals) * 0.1))
-                trimmed_vals = vals[trim:-trim]
-                if trimmed_vals:
-                    avg_rssi = sum(trimmed_vals) / len(trimmed_vals)
-            elif count > 0:
-                avg_rssi = sum(session['readings']) / count
+                if calib.window_full():
+                    if calib.window_stdev() < 2.0 and elapsed > 15:
+                        is_stable = True
+                
+                if elapsed >= 45:
+                    is_stable = True
+                    
+                progress = min(99, int((elapsed / 25.0) * 100))
+                if is_stable: progress = 100
+
+                avg_rssi = -100
+                if progress == 100 and count > 10:
+                    trimmed = calib.trimmed_mean()
+                    if trimmed is not None:
+                        avg_rssi = trimmed
+                elif count > 0:
+                    avg_rssi = calib.mean()
             
-            return json.dumps({
+            return self._json_response({
                 'progress': int(progress),
                 'last_rssi': last_rssi,
                 'avg_rssi': avg_rssi,
@@ -577,20 +729,45 @@ class WebAdmin:
                 'stable': is_stable
             })
             
-        return json.dumps({'error': 'Invalid action'})
+        return self._json_response({'error': 'Invalid action'})
 
     def view_logs(self):
-        log_content = ""
+        # The page fetches /logs/raw itself
+        return render_template('logs.html')
+
+    def view_logs_raw(self):
+        """Streams the log tail as plain text."""
+        # The file's mtime/size is the version; skip the tail read on a match
         try:
-             with open('/home/rpi/gatekeeper.log', 'r') as f:
-                 lines = f.readlines()
-                 # Filter out noisy werkzeug logs for the UI
-                 filtered_lines = [line for line in lines if "[werkzeug]" not in line]
-                 log_content = "".join(filtered_lines[-200:])
-        except:
-            log_content = "Log file not found or unreadable."
-            
-        return render_template('logs.html', logs=log_content)
+            st = os.stat(LOG_FILE)
+            etag = f"{st.st_mtime_ns:x}-{st.st_size:x}"
+        except OSError:
+            etag = None
+        if etag and request.if_none_match.contains(etag):
+            return Response(status=304, headers={'ETag': f'"{etag}"', 'Cache-Control': 'no-cache'})
+
+        # Another client (or tab) may already have read this version of the file
+        cached_etag, lines = self._log_cache
+        if etag is None or etag != cached_etag:
+            try:
+                # Filter out noisy werkzeug logs for the UI
+                lines = _tail_lines(LOG_FILE, 200, exclude="[werkzeug]")
+            except OSError:
+                lines = ["Log file not found or unreadable."]
+            if etag:
+                self._log_cache = (etag, lines)
+
+        def generate():
+            for line in lines:
+                yield line + "\n"
+
+        # no-cache, not no-store: the browser keeps the body but revalidates
+        # it with the ETag on every poll, getting a 304 while the log is unchanged
+        resp = Response(generate(), mimetype='text/plain',
+                        headers={'Cache-Control': 'no-cache'})
+        if etag:
+            resp.set_etag(etag)
+        return resp
 
     def restart_service(self):
         flash('Restart triggered (Not implemented in Thread mode yet)')
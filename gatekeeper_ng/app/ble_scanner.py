@@ -6,36 +6,132 @@ import time
 import threading
 import subprocess
 import os
+import re
+from collections import OrderedDict, deque
+from functools import lru_cache
+
+# Raw HCI socket constants (Linux); the socket module only exposes them when
+# Python was built with Bluetooth headers
+AF_BLUETOOTH = getattr(socket, 'AF_BLUETOOTH', 31)
+BTPROTO_HCI = getattr(socket, 'BTPROTO_HCI', 1)
+SOL_HCI = getattr(socket, 'SOL_HCI', 0)
+HCI_FILTER = getattr(socket, 'HCI_FILTER', 2)
+
+DEVICE_EXPIRY = 300  # seconds before an unheard device is dropped
+RSSI_CHANGE_THRESHOLD = 5  # dBm change that gets through the per-MAC throttle
+
+AD_MANUFACTURER_DATA = 0xFF
+_NAME_TYPES = frozenset((0x08, 0x09))  # shortened / complete local name
+
+HCI_EVENT_PKT = 0x04
+EVT_LE_META_EVENT = 0x3E
+# struct hci_ufilter: type mask, event mask (2 x 32 bits), opcode, padded to
+# 16 bytes (newer kernels reject any other optlen).
+# Only HCI event packets, and of those only LE Meta events.
+LE_META_FILTER = struct.pack('<IIIH2x', 1 << HCI_EVENT_PKT, 0, 1 << (EVT_LE_META_EVENT - 32), 0)
+
+# Start of a packet in hcidump -R output
+_FRAME_START = re.compile(rb'^[<>] ', re.M)
+
+@lru_cache(maxsize=4096)
+def _mac_str(addr_bytes):
+    """'AA:BB:CC:DD:EE:FF' from the 6 little-endian address bytes of a report."""
+    return addr_bytes[::-1].hex(':').upper()
+
+@lru_cache(maxsize=1024)
+def _uuid_str(uuid_bytes):
+    """Canonical uppercase UUID string from 16 iBeacon UUID bytes."""
+    h = uuid_bytes.hex().upper()
+    return f"{h[0:8]}-{h[8:12]}-{h[12:16]}-{h[16:20]}-{h[20:32]}"
+
+def parse_interval(value, default=1.0):
+    """PREF_MIN_ADV_INTERVAL setting as non-negative seconds."""
+    try:
+        return max(0.0, float(value))
+    except (TypeError, ValueError):
+        return default
 
 class BLEScanner:
-    def __init__(self, device_id=0):
+    def __init__(self, device_id=0, min_adv_interval=1.0):
         self.device_id = device_id
+        # Adverts from a MAC within this many seconds of the last one passed on
+        # (and with a similar RSSI) are dropped; 0 disables
+        self.min_adv_interval = min_adv_interval
         self.scanning = False
         self.logger = logging.getLogger("BLEScanner")
         self.callback = None
-        self.discovered_devices = {}
+        # mac -> entry, least recently seen first; read from the web admin thread
+        self.discovered_devices = OrderedDict()
+        self.discovered_lock = threading.Lock()
         self.loop = asyncio.get_running_loop()
         self.thread = None
         self.proc = None
+        self.sock = None
+        # Records waiting for the async callback; one drainer task empties it
+        self._inbox = deque()
+        self._signaled = False
+        self._wake = asyncio.Event()
+        # Set to cut scan_loop's health-check sleep short
+        self._stopped = asyncio.Event()
 
     def parse_hex_packet(self, hex_str):
         try:
-            # hex_str is space-separated hex like "04 3E 21 02 01 ..."
-            data = bytes.fromhex(hex_str.replace(" ", ""))
-            if len(data) < 4: return
-            
-            # HCI Packet Type 0x04 (Event)
-            if data[0] != 0x04: return
-            
-            # Event Code 0x3E (LE Meta Event)
-            if data[1] != 0x3E: return
-            
-            # Subevent 0x02 (LE Advertising Report)
-            if data[3] != 0x02: return
-            
-            self.parse_le_advertising_report(data[4:])
+            # hex_str is whitespace-separated hex like "04 3E 21 02 01 ...";
+            # fromhex skips the whitespace itself
+            self.parse_hci_packet(bytes.fromhex(hex_str))
         except Exception as e:
-            self.logger.debug(f"Parser error: {e}")
+            self.logger.debug("Parser error: %s", e)
+
+    def parse_hci_packet(self, data):
+        if len(data) < 4: return
+        
+        # HCI Packet Type 0x04 (Event)
+        if data[0] != HCI_EVENT_PKT: return
+        
+        # Event Code 0x3E (LE Meta Event)
+        if data[1] != EVT_LE_META_EVENT: return
+        
+        # Subevent 0x02 (LE Advertising Report)
+        if data[3] != 0x02: return
+        
+        self.parse_le_advertising_report(data[4:])
+
+    def _open_hci_socket(self):
+        """Raw HCI socket filtered to LE Meta events, or None if unavailable."""
+        try:
+            sock = socket.socket(AF_BLUETOOTH, socket.SOCK_RAW, BTPROTO_HCI)
+        except (OSError, AttributeError) as e:
+            self.logger.warning(f"Raw HCI socket unavailable ({e}), falling back to hcidump")
+            return None
+        try:
+            sock.setsockopt(SOL_HCI, HCI_FILTER, LE_META_FILTER)
+            sock.bind((self.device_id,))
+            sock.setblocking(False)
+        except OSError as e:
+            self.logger.warning(f"Raw HCI socket setup failed ({e}), falling back to hcidump")
+            sock.close()
+            return None
+        return sock
+
+    def _on_hci_readable(self):
+        # One HCI frame per recv; drain whatever is queued
+        while True:
+            try:
+                frame = self.sock.recv(260)
+            except (BlockingIOError, InterruptedError):
+                return
+            except OSError as e:
+                self.logger.error(f"HCI socket error: {e}")
+                # Level-triggered: leaving the reader on a dead socket would spin
+                self.loop.remove_reader(self.sock.fileno())
+                self.scanning = False
+                self._stopped.set()
+                return
+            if not frame: return
+            try:
+                self.parse_hci_packet(frame)
+            except Exception as e:
+                self.logger.debug("Parser error: %s", e)
 
     def parse_le_advertising_report(self, data):
         try:
@@ -45,15 +141,17 @@ class BLEScanner:
                 if offset >= len(data): break
                 event_type = data[offset]; offset += 2 # type and addr_type
                 
-                addr_bytes = data[offset:offset+6]
+                # Repeat advertisers hit the formatting caches
+                mac = _mac_str(bytes(data[offset:offset+6]))
                 offset += 6
-                mac = ':'.join(f'{b:02X}' for b in reversed(addr_bytes))
                 
                 data_len = data[offset]; offset += 1
                 payload = data[offset:offset+data_len]
                 offset += data_len
-                rssi = struct.unpack('b', data[offset:offset+1])[0]
+                rssi = data[offset]
+                if rssi > 127: rssi -= 256  # signed dBm
                 offset += 1
+                if self._throttled(mac, rssi): continue
                 
                 name_str = None
                 identifier = mac
@@ -65,66 +163,120 @@ class BLEScanner:
                     ad_type = payload[p_offset + 1]
                     ad_data = payload[p_offset + 2 : p_offset + 1 + ad_len]
                     
-                    if ad_type in [0x08, 0x09]:
+                    if ad_type in _NAME_TYPES:
                         try: name_str = ad_data.decode('utf-8')
                         except: pass
-                    elif ad_type == 0xFF: # iBeacon
+                    elif ad_type == AD_MANUFACTURER_DATA: # iBeacon
                         if len(ad_data) >= 25 and ad_data[0:3] == b'\x4c\x00\x02':
-                            uuid_bytes = ad_data[4:20]
-                            identifier = '-'.join([uuid_bytes[0:4].hex(), uuid_bytes[4:6].hex(), uuid_bytes[6:8].hex(), uuid_bytes[8:10].hex(), uuid_bytes[10:16].hex()]).upper()
-                            extra = {'major': struct.unpack('>H', ad_data[20:22])[0], 'minor': struct.unpack('>H', ad_data[22:24])[0]}
+                            identifier = _uuid_str(bytes(ad_data[4:20]))
+                            extra = {'major': (ad_data[20] << 8) | ad_data[21], 'minor': (ad_data[22] << 8) | ad_data[23]}
                     p_offset += (ad_len + 1)
 
                 record = {'mac': mac, 'identifier': identifier, 'rssi': rssi, 'name': name_str, 'extra': extra}
                 if self.callback:
                     if asyncio.iscoroutinefunction(self.callback):
-                        asyncio.run_coroutine_threadsafe(self.callback(record), self.loop)
+                        self._enqueue(record)
                     else: self.callback(record)
-                self.discovered_devices[mac] = {'mac': mac, 'name': name_str or "Unknown", 'rssi': rssi, 'last_seen': time.time()}
+                self._remember(mac, name_str, rssi)
         except Exception as e:
-            self.logger.debug(f"Adv Parse error: {e}")
+            self.logger.debug("Adv Parse error: %s", e)
+
+    def _throttled(self, mac, rssi):
+        if not self.min_adv_interval: return False
+        entry = self.discovered_devices.get(mac)
+        if entry is None: return False
+        return (time.time() - entry['last_seen'] < self.min_adv_interval
+                and abs(rssi - entry['rssi']) < RSSI_CHANGE_THRESHOLD)
+
+    def _enqueue(self, record):
+        # Only the first record of a burst wakes the loop; the rest ride along
+        self._inbox.append(record)
+        if not self._signaled:
+            self._signaled = True
+            self.loop.call_soon_threadsafe(self._wake.set)
+
+    async def _drain(self):
+        inbox = self._inbox
+        while True:
+            await self._wake.wait()
+            self._wake.clear()
+            self._signaled = False
+            while inbox:
+                try:
+                    await self.callback(inbox.popleft())
+                except Exception as e:
+                    self.logger.error(f"Callback error: {e}")
+
+    def _remember(self, mac, name, rssi):
+        now = time.time()
+        with self.discovered_lock:
+            devices = self.discovered_devices
+            entry = devices.get(mac)
+            if entry is None:
+                devices[mac] = {'mac': mac, 'name': name or "Unknown", 'rssi': rssi, 'last_seen': now}
+            else:
+                # Update in place; keep a name learned from an earlier advert
+                devices.move_to_end(mac)
+                if name: entry['name'] = name
+                entry['rssi'] = rssi
+                entry['last_seen'] = now
+            # Forget devices not heard from in DEVICE_EXPIRY (oldest are at the front)
+            while devices:
+                oldest = next(iter(devices.values()))
+                if now - oldest['last_seen'] <= DEVICE_EXPIRY: break
+                devices.popitem(last=False)
+
+    def stop(self):
+        """Ask scan_loop to wind down; safe from any thread."""
+        self.scanning = False
+        self.loop.call_soon_threadsafe(self._stopped.set)
 
     def get_recent_devices(self, seconds=30):
         """Returns a list of devices seen within the last X seconds."""
-        now = time.time()
+        cutoff = time.time() - seconds
         results = []
-        for mac, data in list(self.discovered_devices.items()):
-            if now - data.get('last_seen', 0) < seconds:
-                results.append(data)
+        with self.discovered_lock:
+            for data in reversed(self.discovered_devices.values()):
+                if data['last_seen'] <= cutoff: break
+                results.append(dict(data))
         return results
 
     def _worker(self):
         self.logger.info("BLE hcidump Worker Started")
-        current_packet = ""
+        fd = self.proc.stdout.fileno()
+        buf = bytearray()
         try:
-            # hcidump -R output is multi-line. Packets start with "> " or "< ".
-            # Indented lines are continuations of the same packet.
-            for line in iter(self.proc.stdout.readline, b''):
-                if not self.scanning: break
-                line_str = line.decode('utf-8').rstrip()
-                if not line_str: continue
-
-                if line_str.startswith('> ') or line_str.startswith('< '):
-                    # New packet starts. Process the old one first.
-                    if current_packet:
-                        self.parse_hex_packet(current_packet)
-                    current_packet = line_str[2:]
-                elif line_str.startswith('  '):
-                    # Continuation line
-                    current_packet += line_str.strip()
-            
+            # hcidump -R output is multi-line. Packets start with "> " or "< "
+            # at the beginning of a line; indented lines continue the packet.
+            # Read raw chunks and cut frames at those starts: a frame is
+            # complete once the next one begins.
+            while self.scanning:
+                chunk = os.read(fd, 65536)
+                if not chunk: break
+                buf += chunk
+                starts = [m.start() for m in _FRAME_START.finditer(buf)]
+                if len(starts) < 2:
+                    continue
+                # Non-ASCII junk survives decoding and is dropped by fromhex
+                for begin, end in zip(starts, starts[1:]):
+                    self.parse_hex_packet(buf[begin + 2:end].decode('ascii', 'replace'))
+                del buf[:starts[-1]]
+
             # Final packet
-            if current_packet:
-                self.parse_hex_packet(current_packet)
-                
+            m = _FRAME_START.search(buf)
+            if m:
+                self.parse_hex_packet(buf[m.start() + 2:].decode('ascii', 'replace'))
+
         except Exception as e:
             if self.scanning: self.logger.error(f"Worker Loop Error: {e}")
         finally:
             self.logger.info("BLE hcidump Worker Stopped")
 
     async def scan_loop(self):
-        self.logger.info("Starting hcidump-based BLE Scan Loop")
+        self.logger.info("Starting BLE Scan Loop")
         hcitool_proc = None
+        loop = asyncio.get_running_loop()
+        drainer = loop.create_task(self._drain())
         try:
             # 1. Start background scan to trigger hardware
             subprocess.run(["sudo", "hciconfig", f"hci{self.device_id}", "up"], check=False)
@@ -134,25 +286,34 @@ class BLEScanner:
                 stderr=subprocess.DEVNULL
             )
             
-            # 2. Start hcidump -R (Raw Hex)
-            self.proc = subprocess.Popen(
-                ["sudo", "hcidump", "-i", f"hci{self.device_id}", "-R"],
-                stdout=subprocess.PIPE,
-                stderr=subprocess.DEVNULL
-            )
-            
+            # 2. Read advertising reports: binary frames from a raw HCI socket
+            #    on the event loop, or hcidump -R (Raw Hex) in a thread as fallback
             self.scanning = True
-            self.thread = threading.Thread(target=self._worker, daemon=True)
-            self.thread.start()
+            self._stopped.clear()
+            self.sock = self._open_hci_socket()
+            if self.sock:
+                self.logger.info("Reading LE advertising reports from raw HCI socket")
+                loop.add_reader(self.sock.fileno(), self._on_hci_readable)
+            else:
+                self.proc = subprocess.Popen(
+                    ["sudo", "hcidump", "-i", f"hci{self.device_id}", "-R"],
+                    stdout=subprocess.PIPE,
+                    stderr=subprocess.DEVNULL
+                )
+                self.thread = threading.Thread(target=self._worker, daemon=True)
+                self.thread.start()
             
             while self.scanning:
                 # Check health of sub-processes
                 if hcitool_proc.poll() is not None:
                     hcitool_proc = subprocess.Popen(["sudo", "hcitool", "lescan", "--duplicates", "--passive"], stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
-                if self.proc.poll() is not None:
+                if self.proc and self.proc.poll() is not None:
                     self.logger.error("hcidump died!")
                     break
-                await asyncio.sleep(5)
+                try:
+                    await asyncio.wait_for(self._stopped.wait(), 5)
+                except asyncio.TimeoutError:
+                    pass
                 
         except asyncio.CancelledError:
             self.logger.info("Scan loop task cancelled")
@@ -160,6 +321,11 @@ class BLEScanner:
             self.logger.error(f"Scan loop error: {e}")
         finally:
             self.scanning = False
+            drainer.cancel()
+            if self.sock:
+                loop.remove_reader(self.sock.fileno())
+                self.sock.close()
+                self.sock = None
             if hcitool_proc:
                 hcitool_proc.terminate()
             if self.proc:
@@ -1,9 +1,23 @@
+import atexit
+import copy
 import json
 import os
 import shutil
+import tempfile
 import logging
 import threading
 
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+def device_key(device):
+    """Lookup key for a device entry as returned by ConfigManager (already uppercased)."""
+    return device['identifier']
+
+FLUSH_DELAY = 5.0  # seconds a deferred save may wait before hitting the disk
+
 class ConfigManager:
     """
     Manages loading and saving of configuration files with atomic writes
@@ -18,6 +32,20 @@ class ConfigManager:
         # Thread safety lock for file operations
         self.lock = threading.Lock()
         
+        # Parsed file cache: path -> ((mtime_ns, size), data)
+        self._cache = {}
+        # Device index built from the cached device list it was derived from
+        self._device_index = {}
+        self._known_identifiers = frozenset()
+        self._device_index_src = None
+
+        # Deferred saves: path -> (data, normalize), written by a debounced flush
+        self._pending = {}
+        self._pending_seq = 0
+        self._flush_timer = None
+        self._flush_lock = threading.Lock()
+        atexit.register(self._flush_at_exit)
+        
         # Ensure config dir exists
         os.makedirs(self.config_dir, exist_ok=True)
         
@@ -26,47 +54,197 @@ class ConfigManager:
         self.settings_file = os.path.join(self.config_dir, 'settings.json')
         self.satellites_file = os.path.join(self.config_dir, 'satellites.json')
 
-    def _atomic_write(self, filepath, data):
-        """Helper to write data to a file atomically."""
-        tmp_path = filepath + ".tmp"
+    def _atomic_write(self, filepath, data, normalize=None):
+        """Helper to write data to a file atomically. Returns True on success."""
+        tmp_path = None
         try:
+            # Serialize up front so the file gets a single write() of the whole payload
+            if orjson:
+                payload = orjson.dumps(data, option=orjson.OPT_INDENT_2)
+            else:
+                payload = json.dumps(data, indent=4).encode()
             with self.lock:
-                with open(tmp_path, 'w') as f:
-                    json.dump(data, f, indent=4)
-                    f.flush()
-                    os.fsync(f.fileno()) # Ensure write to disk
+                # Unique staging file next to the target so os.replace stays atomic
+                fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(filepath), prefix=os.path.basename(filepath) + '.', suffix='.tmp')
+                try:
+                    # os.write may write less than asked (e.g. disk full)
+                    view = memoryview(payload)
+                    while view:
+                        written = os.write(fd, view)
+                        if written <= 0:
+                            raise OSError(f"short write ({len(payload) - len(view)} of {len(payload)} bytes)")
+                        view = view[written:]
+                    os.fchmod(fd, 0o644)
+                    os.fsync(fd) # Ensure write to disk
+                finally:
+                    os.close(fd)
                 
-                # Atomic rename
+                # Atomic rename, then persist the directory entry
                 os.replace(tmp_path, filepath)
+                tmp_path = None
+                self._fsync_dir(os.path.dirname(filepath))
+
+                # Write-through: the next load is served from memory, not re-read.
+                # Parsed back from the payload so callers keep their own objects.
+                cached = orjson.loads(payload) if orjson else json.loads(payload)
+                if normalize:
+                    normalize(cached)
+                st = os.stat(filepath)
+                self._cache[filepath] = ((st.st_mtime_ns, st.st_size), cached)
+            return True
         except Exception as e:
             self.logger.error(f"Error saving {filepath}: {e}")
-            if os.path.exists(tmp_path):
+            if tmp_path and os.path.exists(tmp_path):
                 try:
                     os.remove(tmp_path)
                 except: pass
+            return False
+
+    @staticmethod
+    def _fsync_dir(path):
+        try:
+            fd = os.open(path, os.O_RDONLY)
+        except OSError:
+            return
+        try:
+            os.fsync(fd)
+        except OSError:
+            pass
+        finally:
+            os.close(fd)
+
+    def _save_deferred(self, filepath, data, normalize=None):
+        """
+        Saves coalesced in memory and written once FLUSH_DELAY after the last
+        one. Loads see the new data immediately. The first save of a file
+        that does not exist yet is written straight away.
+        """
+        if not os.path.exists(filepath):
+            return self._atomic_write(filepath, data, normalize)
+        data = copy.deepcopy(data)
+        if normalize:
+            normalize(data)
+        with self._flush_lock:
+            self._pending[filepath] = (data, normalize)
+            self._pending_seq += 1
+            self._arm_flush_timer()
+        return True
+
+    def _arm_flush_timer(self):
+        # Caller holds _flush_lock
+        if self._flush_timer:
+            self._flush_timer.cancel()
+        self._flush_timer = threading.Timer(FLUSH_DELAY, self.flush)
+        self._flush_timer.daemon = True
+        self._flush_timer.start()
+
+    def flush(self):
+        """
+        Writes any deferred saves to disk now. Returns True if everything
+        was written; failed writes stay pending and are retried after
+        FLUSH_DELAY.
+        """
+        with self._flush_lock:
+            if self._flush_timer:
+                self._flush_timer.cancel()
+                self._flush_timer = None
+            # Entries stay visible to loads until their write has landed
+            for filepath, (data, normalize) in list(self._pending.items()):
+                if self._atomic_write(filepath, data, normalize):
+                    del self._pending[filepath]
+            if self._pending:
+                self._arm_flush_timer()
+                return False
+            return True
+
+    def _flush_at_exit(self):
+        if self.flush():
+            return
+        with self._flush_lock:
+            if self._flush_timer:
+                self._flush_timer.cancel()
+                self._flush_timer = None
+            for filepath in self._pending:
+                self.logger.critical(f"Unsaved changes LOST: could not write {filepath} at exit")
+
+    def file_stamp(self, filepath):
+        """Version stamp of a config file (mtime_ns, size[, seq]), or None if it does not exist."""
+        try:
+            st = os.stat(filepath)
+        except OSError:
+            return None
+        if filepath in self._pending:
+            return (st.st_mtime_ns, st.st_size, self._pending_seq)
+        return (st.st_mtime_ns, st.st_size)
+
+    def _load_cached(self, filepath, normalize=None):
+        """
+        Returns the parsed contents of a JSON file, re-reading it only when
+        its mtime or size changed. Callers must not mutate the result.
+        """
+        pending = self._pending.get(filepath)
+        if pending:
+            return pending[0]
+        st = os.stat(filepath)
+        stamp = (st.st_mtime_ns, st.st_size)
+        cached = self._cache.get(filepath)
+        if cached and cached[0] == stamp:
+            return cached[1]
+        with self.lock:
+            with open(filepath, 'rb') as f:
+                raw = f.read()
+        data = orjson.loads(raw) if orjson else json.loads(raw)
+        if normalize:
+            normalize(data)
+        self._cache[filepath] = (stamp, data)
+        return data
+
+    @staticmethod
+    def _normalize_devices(devices):
+        # Migrate legacy {'mac': ...} entries and normalize identifiers once on
+        # load, so everything downstream can rely on d['identifier']
+        for d in devices:
+            if 'identifier' not in d:
+                d['identifier'] = d.pop('mac', '')
+            d.setdefault('identifier_type', 'mac')
+            d['identifier'] = d['identifier'].strip().upper()
         
-    def load_devices(self):
+    def _cached_devices(self):
         if not os.path.exists(self.devices_file) and self.legacy_path:
             self._migrate_devices()
             
         if os.path.exists(self.devices_file):
             try:
-                with self.lock:
-                    with open(self.devices_file, 'r') as f:
-                        devices = json.load(f)
-                        # Normalize MACs on load
-                        for d in devices:
-                            if d.get('identifier_type') == 'mac' or 'mac' in d:
-                                if 'identifier' in d: d['identifier'] = d['identifier'].upper()
-                                elif 'mac' in d: d['mac'] = d['mac'].upper()
-                        return devices
+                return self._load_cached(self.devices_file, self._normalize_devices)
             except Exception as e:
                 self.logger.error(f"Error loading devices.json: {e}")
-                return []
         return []
 
+    def load_devices(self):
+        return [dict(d) for d in self._cached_devices()]
+
+    def _refresh_device_index(self):
+        devices = self._cached_devices()
+        if devices is not self._device_index_src:
+            self._device_index = {device_key(d): d for d in devices}
+            self._known_identifiers = frozenset(self._device_index)
+            self._device_index_src = devices
+
+    def device_index(self):
+        """
+        Returns {device_key: device} in file order. The index is rebuilt only
+        when devices.json changes; the returned entries are copies.
+        """
+        self._refresh_device_index()
+        return {k: dict(d) for k, d in self._device_index.items()}
+
+    def known_identifiers(self):
+        """Frozenset of the normalized identifiers of all configured devices."""
+        self._refresh_device_index()
+        return self._known_identifiers
+
     def save_devices(self, devices):
-        self._atomic_write(self.devices_file, devices)
+        self._save_deferred(self.devices_file, devices, self._normalize_devices)
 
     def load_mqtt(self):
         defaults = {
@@ -80,14 +258,15 @@ class ConfigManager:
             self._migrate_mqtt()
         if os.path.exists(self.mqtt_file):
             try:
-                with open(self.mqtt_file, 'r') as f:
-                    loaded = json.load(f)
-                    defaults.update(loaded)
-                    return defaults
+                defaults.update(self._load_cached(self.mqtt_file))
+                return defaults
             except Exception as e:
                 self.logger.error(f"Error loading mqtt.json: {e}")
         return defaults
 
+    def save_mqtt(self, conf):
+        return self._atomic_write(self.mqtt_file, conf)
+
     def load_settings(self):
         defaults = {
             "PREF_INTER_SCAN_DELAY": "60",
@@ -95,13 +274,13 @@ class ConfigManager:
             "PREF_DEPART_SCAN_ATTEMPTS": "2",
             "PREF_FAIL_OBSERVATION_TO_DEPART": "1",
             "PREF_BEACON_EXPIRATION": "60",
+            "PREF_MIN_ADV_INTERVAL": "1",
             "PREF_DEVICE_TRACKER_REPORT": "true",
             "PREF_ENABLE_LOGGING": "false"
         }
         if os.path.exists(self.settings_file):
             try:
-                with open(self.settings_file, 'r') as f:
-                    defaults.update(json.load(f))
+                defaults.update(self._load_cached(self.settings_file))
             except Exception as e:
                 self.logger.error(f"Error loading settings.json: {e}")
         return defaults
@@ -109,18 +288,23 @@ class ConfigManager:
     def save_settings(self, settings):
         self._atomic_write(self.settings_file, settings)
 
-    def load_satellites(self):
+    def _cached_satellites(self):
         if os.path.exists(self.satellites_file):
             try:
-                with self.lock:
-                    with open(self.satellites_file, 'r') as f:
-                        return json.load(f)
+                return self._load_cached(self.satellites_file)
             except Exception as e:
                 self.logger.error(f"Error loading satellites.json: {e}")
         return {}
 
+    def load_satellites(self):
+        return {sid: dict(info) for sid, info in self._cached_satellites().items()}
+
+    def satellite_info(self, satellite_id):
+        """Cached entry of one satellite, or None. Callers must not mutate it."""
+        return self._cached_satellites().get(satellite_id)
+
     def save_satellites(self, data):
-        self._atomic_write(self.satellites_file, data)
+        self._save_deferred(self.satellites_file, data)
 
     def _migrate_devices(self):
         legacy_file = os.path.join(self.legacy_path, 'monitor', 'known_static_addresses')
@@ -138,7 +322,7 @@ class ConfigManager:
                         mac = main_part[0].upper()
                         alias = main_part[1] if len(main_part) > 1 else mac
                         dev_type = parts[1].strip() if len(parts) > 1 else 'Bluetooth'
-                        devices.append({'mac': mac, 'alias': alias, 'type': dev_type})
+                        devices.append({'identifier': mac, 'identifier_type': 'mac', 'alias': alias, 'type': dev_type})
             self.save_devices(devices)
         except Exception as e:
             self.logger.error(f"Migration failed: {e}")
@@ -1,7 +1,7 @@
 import asyncio
 import logging
 import signal
-from .ble_scanner import BLEScanner
+from .ble_scanner import BLEScanner, parse_interval
 from .config_mgr import ConfigManager
 from .mqtt_client import MQTTClient
 from .tracker import DeviceTracker
@@ -19,7 +19,8 @@ class CoreService:
         # Init Components
         self.mqtt_client = MQTTClient(mqtt_conf)
         self.tracker = DeviceTracker(self.config_mgr, self.mqtt_client)
-        self.scanner = BLEScanner(device_id=0)
+        settings = self.config_mgr.load_settings()
+        self.scanner = BLEScanner(device_id=0, min_adv_interval=parse_interval(settings.get('PREF_MIN_ADV_INTERVAL')))
         
         # Init Web Admin
         self.web_admin = WebAdmin(self.config_mgr, tracker=self.tracker, scanner=self.scanner)
@@ -67,11 +68,12 @@ class CoreService:
             maintenance_task.cancel()
             scanner_task.cancel()
             self.mqtt_client.stop()
+            self.config_mgr.flush()
             self.logger.info("Service Stopped.")
             
     def stop(self):
         self.running = False
-        self.scanner.scanning = False
+        self.scanner.stop()
 
 async def main_entry(base_path, legacy_path):
     # Setup Logging with more detailed format
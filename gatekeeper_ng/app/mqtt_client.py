@@ -1,7 +1,9 @@
 import asyncio
 import json
 import logging
+import re
 import socket
+import threading
 import uuid
 
 try:
@@ -9,11 +11,29 @@ try:
 except ImportError:
     mqtt = None
 
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+# Payload (de)serialization; paho publishes bytes and str alike
+if orjson:
+    _dumps, _loads = orjson.dumps, orjson.loads
+else:
+    _dumps, _loads = json.dumps, json.loads
+
+# prefix/satellite/<id>/ then uuid/<UUID>, sensor/<name>/<...> or <MAC>
+_TOPIC_RE = re.compile(r'[^/]+/satellite/([^/]+)/(?:uuid/([^/]+)|sensor/([^/]+)/|([^/]+))')
+
+INBOX_SIZE = 10000  # queued satellite packets before new ones are dropped
+DRAIN_BATCH = 64
+
 class MQTTClient:
     """
     Asyncio-compatible wrapper for Paho MQTT Client.
-    Runs the Paho loop in a background thread but invokes callbacks
-    safely on the main asyncio event loop.
+    The Paho socket is driven from the asyncio event loop (add_reader /
+    add_writer plus a periodic loop_misc), so callbacks run on the loop
+    thread and no background thread is needed.
     """
     def __init__(self, config):
         self.config = config
@@ -25,15 +45,29 @@ class MQTTClient:
         self.topic_prefix = config.get("topic_prefix", "monitor")
         self.identity = "gatekeeper" 
         self.loop = None 
+        self._misc_task = None
+        self._connected_event = None
+        # Satellite packets, consumed by a single drain task
+        self._inbox = None
+        self._drain_task = None
+        # alias -> (state_topic, attr_topic)
+        self._topics = {}
+        # topic -> last payload published there; cleared on (re)connect
+        self._last_published = {}
+        # (alias, identifier_type) -> discovery (topic, payload) pairs
+        self._discovery_cache = {}
 
     async def start(self):
-        """Starts the MQTT client background thread."""
+        """Connects and hooks the MQTT socket into the running event loop."""
         if not mqtt:
             self.logger.error("paho-mqtt library not found. MQTT disabled.")
             return
 
-        # Capture the running loop for thread-safe callbacks
+        # Capture the running loop; Paho socket callbacks register on it
         self.loop = asyncio.get_running_loop()
+        self._connected_event = asyncio.Event()
+        self._inbox = asyncio.Queue(maxsize=INBOX_SIZE)
+        self._drain_task = self.loop.create_task(self._drain())
         
         unique_suffix = str(uuid.uuid4())[:8]
         client_id = f"{self.identity}_{socket.gethostname()}_{unique_suffix}"
@@ -46,30 +80,90 @@ class MQTTClient:
         self.client.on_connect = self._on_connect
         self.client.on_disconnect = self._on_disconnect
         self.client.on_message = self._on_message
+        self.client.on_socket_open = self._on_socket_open
+        self.client.on_socket_close = self._on_socket_close
+        self.client.on_socket_register_write = self._on_socket_register_write
+        self.client.on_socket_unregister_write = self._on_socket_unregister_write
         
         try:
-            # Connect synchronously (blocking brief) then start loop
-            self.client.connect(self.config["broker"], self.config.get("port", 1883), 60)
-            self.client.loop_start()
-            self.logger.info("MQTT Client background thread started.")
-            
-            # Wait for connection check
-            for _ in range(50):
-                if self.connected:
-                    break
-                await asyncio.sleep(0.1)
-                
+            # DNS + TCP connect block, so they run in an executor thread;
+            # the socket then lives on the loop
+            await self.loop.run_in_executor(
+                None, self.client.connect, self.config["broker"], self.config.get("port", 1883), 60
+            )
+            self.logger.info("MQTT Client attached to event loop.")
         except Exception as e:
             self.logger.error(f"Failed to connect to MQTT: {e}")
 
+        # Keepalives and reconnects
+        self._misc_task = self.loop.create_task(self._misc_loop())
+
+        # Wait for connection check
+        try:
+            await asyncio.wait_for(self._connected_event.wait(), timeout=5)
+        except asyncio.TimeoutError:
+            self.logger.warning("MQTT not connected yet; will keep retrying")
+
     def stop(self):
+        for task in (self._misc_task, self._drain_task):
+            if task:
+                task.cancel()
+        self._misc_task = self._drain_task = None
         if self.client:
-            self.client.loop_stop()
             self.client.disconnect()
 
+    async def _misc_loop(self):
+        while True:
+            await asyncio.sleep(1)
+            if self.client.loop_misc() == mqtt.MQTT_ERR_NO_CONN:
+                try:
+                    # Off the loop: a down broker would otherwise stall it for the connect timeout
+                    await self.loop.run_in_executor(None, self.client.reconnect)
+                except Exception as e:
+                    self.logger.warning(f"MQTT reconnect failed: {e}")
+                    await asyncio.sleep(4)
+
+    def _on_loop(self, fn, *args):
+        """
+        Run an event loop call from a Paho socket hook. Hooks fire on the
+        loop, or on the executor thread running connect/reconnect; there the
+        call is handed to the loop and waited for, so it lands before Paho
+        goes on (e.g. closes the socket).
+        """
+        try:
+            on_loop = asyncio.get_running_loop() is self.loop
+        except RuntimeError:
+            on_loop = False
+        if on_loop:
+            fn(*args)
+            return
+        done = threading.Event()
+        def run():
+            try:
+                fn(*args)
+            finally:
+                done.set()
+        self.loop.call_soon_threadsafe(run)
+        done.wait(5)
+
+    def _on_socket_open(self, client, userdata, sock):
+        self._on_loop(self.loop.add_reader, sock, client.loop_read)
+
+    def _on_socket_close(self, client, userdata, sock):
+        self._on_loop(self.loop.remove_reader, sock)
+        self._on_loop(self.loop.remove_writer, sock)
+
+    def _on_socket_register_write(self, client, userdata, sock):
+        self._on_loop(self.loop.add_writer, sock, client.loop_write)
+
+    def _on_socket_unregister_write(self, client, userdata, sock):
+        self._on_loop(self.loop.remove_writer, sock)
+
     def _on_connect(self, client, userdata, flags, rc, properties=None):
         if rc == 0:
             self.connected = True
+            self._connected_event.set()
+            self._last_published.clear()
             self.logger.info("Connected to MQTT Broker")
             # Subscribe to satellite topics
             topic = f"{self.topic_prefix}/satellite/#" 
@@ -79,89 +173,89 @@ class MQTTClient:
             self.logger.error(f"Failed to connect: {rc}")
 
     def _on_message(self, client, userdata, msg):
-        """Handle incoming messages in Paho thread."""
+        """Handle incoming messages (runs on the event loop)."""
         try:
             # Topic: prefix/satellite/satellite_id/...
-            parts = msg.topic.split('/')
-            
-            if len(parts) < 3 or parts[1] != 'satellite':
+            m = _TOPIC_RE.match(msg.topic)
+            if not m:
                 return
-            
-            satellite_id = parts[2]
-            
+            satellite_id, uuid_val, sensor_name, mac = m.groups()
+
             # Dispatch to async callback slightly differently for MAC vs UUID
             # UUID: .../uuid/UUID -> Payload JSON
-            if len(parts) >= 5 and parts[3] == 'uuid':
-                uuid_val = parts[4]
+            if uuid_val:
                 try:
-                    payload = json.loads(msg.payload.decode())
+                    payload = _loads(msg.payload)
                     rssi = int(payload.get('rssi', -100))
                     extra = {'major': payload.get('major'), 'minor': payload.get('minor')}
                     
                     self._dispatch_callback(satellite_id, uuid_val, rssi, extra)
                 except Exception as e:
                     self.logger.warning(f"Invalid UUID payload: {e}")
-            
+
+            # Health sensors: .../sensor/name/state
+            elif sensor_name:
+                try:
+                    value = msg.payload.decode()
+                    self._dispatch_health_callback(satellite_id, sensor_name, value)
+                except: pass
+
             # MAC: .../MAC -> Payload RSSI (int)
-            elif len(parts) >= 4:
-                # Check for health sensors: .../sensor/name/state
-                if parts[3] == 'sensor' and len(parts) >= 6:
-                    sensor_name = parts[4]
-                    try:
-                        value = msg.payload.decode()
-                        self._dispatch_health_callback(satellite_id, sensor_name, value)
-                    except: pass
-                else:
-                    mac = parts[3].upper()
-                    try:
-                        rssi = int(float(msg.payload.decode()))
-                        self._dispatch_callback(satellite_id, mac, rssi, {})
-                    except ValueError:
-                        pass
+            else:
+                try:
+                    # float() parses the payload bytes directly
+                    rssi = int(float(msg.payload))
+                    # Identifiers are uppercased once, in the tracker
+                    self._dispatch_callback(satellite_id, mac, rssi, {})
+                except ValueError:
+                    pass
 
         except Exception as e:
             self.logger.error(f"Error processing message: {e}")
 
     def _dispatch_health_callback(self, sid, name, val):
-        """Thread-safe dispatch to main loop for health stats."""
+        """Schedule the health stats callback on the loop."""
         if self.health_callback and self.loop:
-            asyncio.run_coroutine_threadsafe(
-                self.health_callback(sid, name, val), 
-                self.loop
-            )
+            self.loop.create_task(self.health_callback(sid, name, val))
 
     def _dispatch_callback(self, sid, ident, rssi, extra):
-        """Thread-safe dispatch to main loop."""
-        if self.satellite_callback and self.loop:
-            asyncio.run_coroutine_threadsafe(
-                self.satellite_callback(sid, ident, rssi, extra), 
-                self.loop
-            )
+        """Queue a satellite packet for the drain task."""
+        if self.satellite_callback and self._inbox:
+            try:
+                self._inbox.put_nowait((sid, ident, rssi, extra))
+            except asyncio.QueueFull:
+                self.logger.warning(f"Satellite inbox full, dropping packet from {sid}")
 
-    def _on_disconnect(self, client, userdata, flags, rc, properties=None):
+    async def _drain(self):
+        inbox = self._inbox
+        while True:
+            batch = [await inbox.get()]
+            while len(batch) < DRAIN_BATCH and not inbox.empty():
+                batch.append(inbox.get_nowait())
+            for sid, ident, rssi, extra in batch:
+                try:
+                    await self.satellite_callback(sid, ident, rssi, extra)
+                except Exception as e:
+                    self.logger.error(f"Error handling packet from {sid}: {e}")
+
+    def _on_disconnect(self, client, userdata, *args):
         self.logger.warning("Disconnected from MQTT Broker")
         self.connected = False
+        self._connected_event.clear()
 
     async def publish_presence(self, device, present, rssi=None, attributes=None):
         """Publish device tracker state to HA."""
         if not self.client or not self.connected: 
             return
 
-        alias = device['alias']
-        # Normalize alias for topic usage
-        safe_alias = alias.replace(' ', '_').replace('-', '_').lower()
-        
-        topic_base = f"{self.topic_prefix}/{self.identity}/{safe_alias}"
-        state_topic = f"{topic_base}/device_tracker"
-        attr_topic = topic_base 
+        state_topic, attr_topic = self._presence_topics(device['alias'])
         
         payload = "home" if present else "not_home"
         
-        # Publish calls are thread-safe in Paho
-        self.client.publish(state_topic, payload, retain=True)
+        self._publish_changed(state_topic, payload)
         
-        identifier = device.get('identifier', device.get('mac'))
-        id_type = device.get('identifier_type', 'mac')
+        identifier = device['identifier']
+        id_type = device['identifier_type']
         
         attr_data = {
             "rssi": rssi,
@@ -175,11 +269,28 @@ class MQTTClient:
         if attributes:
             attr_data.update(attributes)
             
-        self.client.publish(attr_topic, json.dumps(attr_data), retain=True)
+        self._publish_changed(attr_topic, _dumps(attr_data))
+
+    def _presence_topics(self, alias):
+        topics = self._topics.get(alias)
+        if topics is None:
+            # Normalize alias for topic usage
+            safe_alias = alias.replace(' ', '_').replace('-', '_').lower()
+            topic_base = f"{self.topic_prefix}/{self.identity}/{safe_alias}"
+            topics = self._topics[alias] = (f"{topic_base}/device_tracker", topic_base)
+        return topics
+
+    def _publish_changed(self, topic, payload):
+        """Publish a retained payload unless it is what the topic already holds."""
+        if self._last_published.get(topic) == payload:
+            return
+        self._last_published[topic] = payload
+        self.client.publish(topic, payload, retain=True)
 
     async def publish_discovery(self, devices):
         """Publish Home Assistant Discovery payloads."""
         if not self.connected: return
+        msgs = []  # (topic, payload) pairs, all retained
             
         # 0. HUB Discovery (The "Parent" device)
         hub_id = f"gk_{self.identity}_hub"
@@ -200,103 +311,119 @@ class MQTTClient:
             "device_class": "connectivity",
             "device": hub_device
         }
-        self.client.publish(hub_disc_topic, json.dumps(hub_payload), retain=True)
+        msgs.append((hub_disc_topic, _dumps(hub_payload)))
         # Also publish the hub status itself
-        self.client.publish(f"{self.topic_prefix}/{self.identity}/status", "online", retain=True)
+        msgs.append((f"{self.topic_prefix}/{self.identity}/status", "online"))
 
         for d in devices:
             alias = d['alias']
-            
-            # --- CLEANUP LEGACY TOPICS ---
-            # Old node IDs used hyphens/caps and different unique_id schemes
-            old_safe = alias.replace(' ', '_')
-            old_node = f"gk_{self.identity}_{old_safe}"
-            # Clear old device tracker (it used node_id as unique_id)
-            self.client.publish(f"homeassistant/device_tracker/{old_node}/config", "", retain=True)
-            # Clear old sensors (Step 1453 style)
-            for s in ["room", "distance", "rssi"]:
-                self.client.publish(f"homeassistant/sensor/{old_node}_{s}/config", "", retain=True)
-            
-            # --- NEW CLEAN NAMING ---
-            safe_alias = alias.replace(' ', '_').replace('-', '_').lower()
-            node_id = f"gk_{self.identity}_{safe_alias}"
-            
-            # Additional Cleanup: Clear the lowercased node_id tracker topic (pre-Step 1627)
-            self.client.publish(f"homeassistant/device_tracker/{node_id}/config", "", retain=True)
-            
-            # Tracker Unique ID
-            disc_topic = f"homeassistant/device_tracker/{node_id}/config"
-            
-            monitor_alias = safe_alias 
-            state_topic = f"{self.topic_prefix}/{self.identity}/{monitor_alias}/device_tracker"
-            attr_topic = f"{self.topic_prefix}/{self.identity}/{monitor_alias}"
-            
-            id_type = d.get('identifier_type', 'mac')
-            
-            # Device definition for this tracked entity
-            device_info = {
-                "identifiers": [f"device_{node_id}"],
-                "name": alias,
-                "manufacturer": "Gatekeeper",
-                "model": "Generic Tracked Device",
-                "via_device": hub_id
-            }
-
-            payload = {
-                "name": "Presence",
-                "unique_id": f"{node_id}_presence",
-                "state_topic": state_topic,
-                "payload_home": "home",
-                "payload_not_home": "not_home",
-                "source_type": "bluetooth",
-                "json_attributes_topic": attr_topic,
-                "icon": "mdi:bluetooth" if id_type == 'mac' else "mdi:identifier-variant",
-                "device": device_info
-            }
-            
-            # 1. Device Tracker Discovery
-            self.client.publish(disc_topic, json.dumps(payload), retain=True)
-            
-            # 2. Room Sensor Discovery
-            room_node_id = f"{node_id}_room"
-            room_disc_topic = f"homeassistant/sensor/{room_node_id}/config"
-            room_payload = {
-                "name": "Room",
-                "unique_id": room_node_id,
-                "state_topic": attr_topic,
-                "value_template": "{{ value_json.room }}",
-                "icon": "mdi:room-service",
-                "device": device_info
-            }
-            self.client.publish(room_disc_topic, json.dumps(room_payload), retain=True)
-
-            # 3. Distance Sensor Discovery
-            dist_node_id = f"{node_id}_distance"
-            dist_disc_topic = f"homeassistant/sensor/{dist_node_id}/config"
-            dist_payload = {
-                "name": "Distance",
-                "unique_id": dist_node_id,
-                "state_topic": attr_topic,
-                "value_template": "{{ value_json.distance if value_json.distance != -1 else 'N/A' }}",
-                "unit_of_measurement": "m",
-                "icon": "mdi:ruler",
-                "device": device_info
-            }
-            self.client.publish(dist_disc_topic, json.dumps(dist_payload), retain=True)
-
-            # 4. RSSI Sensor Discovery
-            rssi_node_id = f"{node_id}_rssi"
-            rssi_disc_topic = f"homeassistant/sensor/{rssi_node_id}/config"
-            rssi_payload = {
-                "name": "RSSI",
-                "unique_id": rssi_node_id,
-                "state_topic": attr_topic,
-                "value_template": "{{ value_json.rssi }}",
-                "unit_of_measurement": "dBm",
-                "device_class": "signal_strength",
-                "icon": "mdi:signal",
-                "device": device_info
-            }
-            self.client.publish(rssi_disc_topic, json.dumps(rssi_payload), retain=True)
-
+            # Payloads only depend on alias and identifier type
+            key = (alias, d['identifier_type'])
+            dev_msgs = self._discovery_cache.get(key)
+            if dev_msgs is None:
+                dev_msgs = self._discovery_cache[key] = self._device_discovery(*key, hub_id)
+            msgs.extend(dev_msgs)
             self.logger.info(f"Published Discovery (Tracker + 3 Sensors) for {alias}")
+
+        self._publish_many(msgs)
+
+    def _device_discovery(self, alias, id_type, hub_id):
+        """Discovery (topic, payload) pairs for one tracked device."""
+        msgs = []
+        # --- CLEANUP LEGACY TOPICS ---
+        # Old node IDs used hyphens/caps and different unique_id schemes
+        old_safe = alias.replace(' ', '_')
+        old_node = f"gk_{self.identity}_{old_safe}"
+        # Clear old device tracker (it used node_id as unique_id)
+        msgs.append((f"homeassistant/device_tracker/{old_node}/config", ""))
+        # Clear old sensors (Step 1453 style)
+        for s in ["room", "distance", "rssi"]:
+            msgs.append((f"homeassistant/sensor/{old_node}_{s}/config", ""))
+        
+        # --- NEW CLEAN NAMING ---
+        safe_alias = alias.replace(' ', '_').replace('-', '_').lower()
+        node_id = f"gk_{self.identity}_{safe_alias}"
+        
+        # Additional Cleanup: Clear the lowercased node_id tracker topic (pre-Step 1627)
+        msgs.append((f"homeassistant/device_tracker/{node_id}/config", ""))
+        
+        # Tracker Unique ID
+        disc_topic = f"homeassistant/device_tracker/{node_id}/config"
+        
+        state_topic, attr_topic = self._presence_topics(alias)
+        
+        # Device definition for this tracked entity
+        device_info = {
+            "identifiers": [f"device_{node_id}"],
+            "name": alias,
+            "manufacturer": "Gatekeeper",
+            "model": "Generic Tracked Device",
+            "via_device": hub_id
+        }
+
+        payload = {
+            "name": "Presence",
+            "unique_id": f"{node_id}_presence",
+            "state_topic": state_topic,
+            "payload_home": "home",
+            "payload_not_home": "not_home",
+            "source_type": "bluetooth",
+            "json_attributes_topic": attr_topic,
+            "icon": "mdi:bluetooth" if id_type == 'mac' else "mdi:identifier-variant",
+            "device": device_info
+        }
+        
+        # 1. Device Tracker Discovery
+        msgs.append((disc_topic, _dumps(payload)))
+        
+        # 2. Room Sensor Discovery
+        room_node_id = f"{node_id}_room"
+        room_disc_topic = f"homeassistant/sensor/{room_node_id}/config"
+        room_payload = {
+            "name": "Room",
+            "unique_id": room_node_id,
+            "state_topic": attr_topic,
+            "value_template": "{{ value_json.room }}",
+            "icon": "mdi:room-service",
+            "device": device_info
+        }
+        msgs.append((room_disc_topic, _dumps(room_payload)))
+
+        # 3. Distance Sensor Discovery
+        dist_node_id = f"{node_id}_distance"
+        dist_disc_topic = f"homeassistant/sensor/{dist_node_id}/config"
+        dist_payload = {
+            "name": "Distance",
+            "unique_id": dist_node_id,
+            "state_topic": attr_topic,
+            "value_template": "{{ value_json.distance if value_json.distance != -1 else 'N/A' }}",
+            "unit_of_measurement": "m",
+            "icon": "mdi:ruler",
+            "device": device_info
+        }
+        msgs.append((dist_disc_topic, _dumps(dist_payload)))
+
+        # 4. RSSI Sensor Discovery
+        rssi_node_id = f"{node_id}_rssi"
+        rssi_disc_topic = f"homeassistant/sensor/{rssi_node_id}/config"
+        rssi_payload = {
+            "name": "RSSI",
+            "unique_id": rssi_node_id,
+            "state_topic": attr_topic,
+            "value_template": "{{ value_json.rssi }}",
+            "unit_of_measurement": "dBm",
+            "device_class": "signal_strength",
+            "icon": "mdi:signal",
+            "device": device_info
+        }
+        msgs.append((rssi_disc_topic, _dumps(rssi_payload)))
+        return msgs
+
+    def _publish_many(self, msgs):
+        """
+        Publish retained messages back to back. Paho only queues them here;
+        the loop's single writer callback then flushes the whole batch.
+        """
+        publish = self.client.publish
+        for topic, payload in msgs:
+            publish(topic, payload, retain=True)
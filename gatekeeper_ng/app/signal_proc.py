@@ -1,28 +1,30 @@
-import statistics
 import logging
 import math
+from collections import deque
 
 class SignalBuffer:
+    # One buffer per (satellite, device) pair, so keep instances small
+    __slots__ = ('median_window', 'ema_alpha', 'history', 'ema_value')
+    logger = logging.getLogger("SignalProc")
+
     def __init__(self, median_window=7, ema_alpha=0.2):
         self.median_window = median_window
         self.ema_alpha = ema_alpha
-        self.history = [] # List of recent raw RSSI values
+        self.history = deque(maxlen=median_window) # Recent raw RSSI values
         self.ema_value = None
-        self.logger = logging.getLogger("SignalProc")
 
     def add_sample(self, rssi):
         """
         Adds a raw RSSI sample and returns the filtered (smoothed) value.
         Pipeline: Raw -> Median Filter -> EMA Filter -> Output
         """
-        # 1. Update History Window
+        # 1. Update History Window (the deque drops the oldest sample)
         self.history.append(rssi)
-        if len(self.history) > self.median_window:
-            self.history.pop(0)
             
         # 2. Median Filter (Removes outliers/spikes)
-        # Statistics.median handles odd/even lengths correctly
-        median_val = statistics.median(self.history)
+        s = sorted(self.history)
+        mid = len(s) // 2
+        median_val = s[mid] if len(s) & 1 else (s[mid - 1] + s[mid]) / 2
         
         # 3. EMA Filter (Smoothing)
         # EMA_t = alpha * x_t + (1 - alpha) * EMA_{t-1}
@@ -37,7 +39,7 @@ class SignalBuffer:
         return self.ema_value
 
     def clear(self):
-        self.history = []
+        self.history.clear()
         self.ema_value = None
 
 def calculate_distance(rssi, tx_power=-59, n=2.5):
@@ -1,7 +1,10 @@
 import time
 import logging
 import asyncio
+import threading
+from collections import OrderedDict
 from .signal_proc import SignalBuffer, calculate_distance
+from .config_mgr import device_key
 
 class DeviceTracker:
     def __init__(self, config_mgr, mqtt_client):
@@ -13,6 +16,7 @@ class DeviceTracker:
         # State
         self.known_devices = {} # identifier -> config_dict
         self.current_state = {} 
+        self._present = set() # identifiers whose state is present
         self.satellite_stats = {} # sid -> {sensor_name: value, last_seen: time}
         
         # Signal Buffers
@@ -21,8 +25,10 @@ class DeviceTracker:
         # Zoning State 
         self.zoning_state = {} 
         
-        # Discovery Cache for UI (Shared for iBeacons and BLE MACs)
-        self.discovery_cache = {}
+        # Discovery Cache for UI (Shared for iBeacons and BLE MACs), in last-seen order.
+        # Read by the web admin thread, so guarded by discovery_lock.
+        self.discovery_cache = OrderedDict()
+        self.discovery_lock = threading.Lock()
         
         # Calibration helper
         self.last_sat_signals = {}
@@ -40,11 +46,7 @@ class DeviceTracker:
         devices = self.config_mgr.load_devices()
         self.known_devices = {}
         for d in devices:
-            if 'identifier' in d:
-                key = d['identifier'].upper() if d.get('identifier_type') == 'mac' else d['identifier']
-            else:
-                key = d['mac'].upper()
-            self.known_devices[key] = d
+            self.known_devices[device_key(d)] = d
             
         settings = self.config_mgr.load_settings()
         self.timeout_interval = int(settings.get("PREF_BEACON_EXPIRATION", 60))
@@ -52,11 +54,12 @@ class DeviceTracker:
 
     async def process_satellite_health(self, satellite_id, sensor_name, value):
         """Handle health sensors from satellites (WiFi, Uptime, etc.)"""
-        if satellite_id not in self.satellite_stats:
-            self.satellite_stats[satellite_id] = {}
+        stats = self.satellite_stats.get(satellite_id)
+        if stats is None:
+            stats = self.satellite_stats[satellite_id] = {}
         
-        self.satellite_stats[satellite_id][sensor_name] = value
-        self.satellite_stats[satellite_id]['last_health_update'] = time.time()
+        stats[sensor_name] = value
+        stats['last_health_update'] = time.time()
         
         # Also ensure last_seen in config gets updated via remote packet or here
         await self._check_satellite_registration(satellite_id)
@@ -67,7 +70,9 @@ class DeviceTracker:
         identifier = identifier.upper()
         
         # 1. Update Calibration Cache (Always update with latest for real-time stream)
+        # Wall-clock times are shown/published; monotonic ones only feed internal deltas
         now = time.time()
+        mono = time.monotonic()
         self.last_sat_signals[satellite_id] = {'rssi': rssi, 'time': now}
 
         # 2. Update Discovery Cache (UI only)
@@ -81,8 +86,9 @@ class DeviceTracker:
             return
             
         # 5. Get/Create Device State
-        if identifier not in self.current_state:
-            self.current_state[identifier] = {
+        state = self.current_state.get(identifier)
+        if state is None:
+            state = self.current_state[identifier] = {
                 'identifier': identifier,
                 'sources': {},
                 'present': False,
@@ -92,27 +98,26 @@ class DeviceTracker:
                 'last_seen': 0
             }
         
-        state = self.current_state[identifier]
-        
         # 6. Signal Processing Pipeline
         # Determine room name and reference RSSI
         actual_room = 'Unassigned'
         ref_rssi = -65
         
-        sats = self.config_mgr.load_satellites()
-        if satellite_id in sats:
-            actual_room = sats[satellite_id].get('room', 'Unassigned')
-            ref_rssi = sats[satellite_id].get('ref_rssi_1m', -65)
+        sat_info = self.config_mgr.satellite_info(satellite_id)
+        if sat_info:
+            actual_room = sat_info.get('room', 'Unassigned')
+            ref_rssi = sat_info.get('ref_rssi_1m', -65)
         
         if actual_room == 'Unassigned':
             actual_room = f"Sat:{satellite_id}"
             
         # Signal Smoothing (EMA) via SignalBuffer
         buf_key = (satellite_id, identifier)
-        if buf_key not in self.signal_buffers:
-            self.signal_buffers[buf_key] = SignalBuffer()
+        buf = self.signal_buffers.get(buf_key)
+        if buf is None:
+            buf = self.signal_buffers[buf_key] = SignalBuffer()
         
-        smooth_rssi = self.signal_buffers[buf_key].add_sample(rssi)
+        smooth_rssi = buf.add_sample(rssi)
         dist = calculate_distance(smooth_rssi, tx_power=ref_rssi)
         
         # Update Source Details
@@ -120,7 +125,7 @@ class DeviceTracker:
             'raw_rssi': rssi,
             'smooth_rssi': smooth_rssi,
             'distance': dist,
-            'last_seen': now,
+            'last_seen': mono,
             'room_name': actual_room
         }
         state['last_seen'] = now
@@ -130,47 +135,43 @@ class DeviceTracker:
 
     async def _evaluate_zone(self, identifier):
         state = self.current_state[identifier]
-        now = time.time()
+        now = time.monotonic()
         
-        best_sat = None
-        min_dist = 999.0
+        current_room = state.get('room', 'unknown')
         
-        # 1. Select Best Satellite BASED ON DISTANCE (Lower is closer)
-        for sat, data in state['sources'].items():
-            age = now - data['last_seen']
-            if age < self.absence_timeout:
-                if data['distance'] < min_dist:
-                    min_dist = data['distance']
-                    best_sat = sat
+        # One pass over the fresh sources for:
+        # 1. the best satellite BASED ON DISTANCE (Lower is closer)
+        # 2. the current room's closest satellite
+        candidate_source = None
+        min_dist = 999.0
+        current_room_min_dist = 999.0
+        current_room_best_rssi = -999.0
+        cutoff = now - self.absence_timeout
+        for data in state['sources'].values():
+            if data['last_seen'] <= cutoff: continue
+            dist = data['distance']
+            if dist < min_dist:
+                min_dist = dist
+                candidate_source = data
+            if dist < current_room_min_dist and data['room_name'] == current_room:
+                current_room_min_dist = dist
+                current_room_best_rssi = data['smooth_rssi']
         
-        if not best_sat: return
+        if not candidate_source: return
         
-        candidate_source = state['sources'][best_sat]
         candidate_room = candidate_source['room_name']
         candidate_dist = candidate_source['distance']
         candidate_rssi = candidate_source['smooth_rssi']
         
-        current_room = state.get('room', 'unknown')
-        
-        if identifier not in self.zoning_state:
-            self.zoning_state[identifier] = {'pending_room': None, 'start': 0}
-        z_state = self.zoning_state[identifier]
+        z_state = self.zoning_state.get(identifier)
+        if z_state is None:
+            z_state = self.zoning_state[identifier] = {'pending_room': None, 'start': 0}
         
         # Immediate assignment if currently unknown or not at home
         if current_room in ['unknown', 'Unassigned', 'not_home'] and candidate_room != 'Unassigned':
              await self._change_room(identifier, candidate_room, candidate_rssi, candidate_dist)
              return
         
-        # 2. Get current room metrics
-        current_room_min_dist = 999.0
-        current_room_best_rssi = -999.0
-        for sat, data in state['sources'].items():
-            if (now - data['last_seen']) < self.absence_timeout:
-                if data['room_name'] == current_room:
-                    if data['distance'] < current_room_min_dist:
-                        current_room_min_dist = data['distance']
-                        current_room_best_rssi = data['smooth_rssi']
-        
         # If current room lost all satellites (timeout), switch immediately to best available
         if current_room_min_dist == 999.0:
              self.logger.info(f"[{identifier}] Current room {current_room} TIMEOUT. Switching to {candidate_room}.")
@@ -194,7 +195,7 @@ class DeviceTracker:
         elif candidate_room == current_room:
             # If the best satellite IS the current room, reset any pending jump to another room
             if z_state['pending_room']:
-                self.logger.debug(f"[{identifier}] Resetting pending jump to {z_state['pending_room']} - current is better.")
+                self.logger.debug("[%s] Resetting pending jump to %s - current is better.", identifier, z_state['pending_room'])
             z_state['pending_room'] = None
 
         # Update state with latest metrics from current room if still there
@@ -202,7 +203,8 @@ class DeviceTracker:
             state['rssi'] = current_room_best_rssi
             state['distance'] = current_room_min_dist
             
-            if (now - state.get('last_pub', 0)) > 30:
+            last_pub = state.get('last_pub')
+            if last_pub is None or (now - last_pub) > 30:
                 await self.publish_update(identifier)
 
     async def _change_room(self, identifier, new_room, new_rssi, new_dist):
@@ -212,37 +214,56 @@ class DeviceTracker:
         state['rssi'] = new_rssi
         state['distance'] = new_dist
         state['present'] = True
+        self._present.add(identifier)
         self.logger.info(f"ZONE CHANGE: {identifier} {old_room} -> {new_room} (RSSI: {new_rssi:.1f}, Dist: {new_dist}m)")
         await self.publish_update(identifier)
 
     def _update_discovery_cache(self, satellite_id, identifier, rssi, extra_data):
-        # We cap the cache size just in case
-        if len(self.discovery_cache) > 200:
-             # Clean old ones
-             now = time.time()
-             old_keys = [k for k, v in self.discovery_cache.items() if (now - v['last_seen']) > 300]
-             for k in old_keys: del self.discovery_cache[k]
-             
-        if identifier not in self.discovery_cache:
-            self.discovery_cache[identifier] = {
-                'identifier': identifier, 
-                'rssi': rssi, 
-                'major': extra_data.get('major') if extra_data else None, 
-                'minor': extra_data.get('minor') if extra_data else None,
-                'name': extra_data.get('name') if extra_data else None,
-                'last_seen': time.time(), 
-                'sources': {satellite_id: rssi}
-            }
-        else:
-            c = self.discovery_cache[identifier]
-            c['rssi'] = max(c['rssi'], rssi) # Keep best RSSI
-            c['last_seen'] = time.time()
-            c['sources'][satellite_id] = rssi
-            if extra_data and extra_data.get('name'):
-                c['name'] = extra_data.get('name')
+        now = time.time()
+        with self.discovery_lock:
+            cache = self.discovery_cache
+            # Entries are kept least-recently-seen first, so expired ones sit at the front
+            while cache:
+                oldest = next(iter(cache.values()))
+                if now - oldest['last_seen'] <= 300: break
+                cache.popitem(last=False)
+
+            if identifier not in cache:
+                cache[identifier] = {
+                    'identifier': identifier, 
+                    'rssi': rssi, 
+                    'major': extra_data.get('major') if extra_data else None, 
+                    'minor': extra_data.get('minor') if extra_data else None,
+                    'name': extra_data.get('name') if extra_data else None,
+                    'last_seen': now, 
+                    'sources': {satellite_id: rssi}
+                }
+            else:
+                c = cache[identifier]
+                cache.move_to_end(identifier)
+                c['rssi'] = max(c['rssi'], rssi) # Keep best RSSI
+                c['last_seen'] = now
+                c['sources'][satellite_id] = rssi
+                if extra_data and extra_data.get('name'):
+                    c['name'] = extra_data.get('name')
+
+    def recent_discoveries(self, max_age):
+        """
+        (identifier, entry) pairs seen within max_age seconds, newest first.
+        Entries are copied under the lock, so callers can read them while
+        the tracker keeps updating the cache.
+        """
+        cutoff = time.time() - max_age
+        fresh = []
+        with self.discovery_lock:
+            for identifier, entry in reversed(self.discovery_cache.items()):
+                if entry['last_seen'] < cutoff: break
+                fresh.append((identifier, {**entry, 'sources': dict(entry['sources'])}))
+        return fresh
 
     def clear_discovery_cache(self):
-        self.discovery_cache = {}
+        with self.discovery_lock:
+            self.discovery_cache = OrderedDict()
         self.logger.info("Discovery cache cleared by user.")
 
     async def _check_satellite_registration(self, satellite_id):
@@ -250,10 +271,11 @@ class DeviceTracker:
             satellites = self.config_mgr.load_satellites()
             self._mem_satellites_cache = set(satellites.keys())
         
-        # Load fresh to check/update
-        # Optimization: We could keep 'satellites' in memory but ConfigMgr loads from disk.
-        # For now, let's load-check-save pattern but throttled.
-        
+        # Read-only check against the cached file; copy and save only when needed
+        sat_info = self.config_mgr.satellite_info(satellite_id)
+        if sat_info is not None and (time.time() - sat_info.get('last_seen', 0)) <= 60:
+            return
+
         should_save = False
         satellites = self.config_mgr.load_satellites()
         
@@ -273,10 +295,10 @@ class DeviceTracker:
             self.config_mgr.save_satellites(satellites)
 
     async def publish_update(self, identifier):
-        if identifier not in self.known_devices or identifier not in self.current_state: return
-        conf = self.known_devices[identifier]
-        state = self.current_state[identifier]
-        state['last_pub'] = time.time()
+        conf = self.known_devices.get(identifier)
+        state = self.current_state.get(identifier)
+        if conf is None or state is None: return
+        state['last_pub'] = time.monotonic()
         extra = {
             "room": state.get('room', 'unknown'),
             "distance": state.get('distance', -1),
@@ -289,12 +311,15 @@ class DeviceTracker:
         while True:
             await asyncio.sleep(2)
             now = time.time()
-            for identifier, state in list(self.current_state.items()):
-                if not state['present']: continue
+            mono = time.monotonic()
+            # Only present devices can depart or lose their room
+            for identifier in list(self._present):
+                state = self.current_state[identifier]
                 if (now - state['last_seen']) > self.timeout_interval:
                     dev = self.known_devices.get(identifier, {'alias': identifier})
                     self.logger.info(f"DEPARTURE: {dev['alias']}")
                     state['present'] = False
+                    self._present.discard(identifier)
                     state['room'] = 'not_home'
                     state['distance'] = -1
                     await self.publish_update(identifier)
@@ -302,12 +327,12 @@ class DeviceTracker:
                 current_room = state.get('room')
                 room_alive = False
                 for sat, data in state['sources'].items():
-                     if data['room_name'] == current_room and (now - data['last_seen']) < self.absence_timeout:
+                     if data['room_name'] == current_room and (mono - data['last_seen']) < self.absence_timeout:
                           room_alive = True
                           break
                 if not room_alive and state['present']:
                     await self._evaluate_zone(identifier)
 
     async def process_packet(self, record):
-        # Local packet from Hub
-        await self.process_remote_packet('gatekeeper-hub', record.get('identifier', record['mac'].upper()), record['rssi'], extra_data=record)
+        # Local packet from Hub; the scanner already formats identifiers uppercase
+        await self.process_remote_packet('gatekeeper-hub', record['identifier'], record['rssi'], extra_data=record)
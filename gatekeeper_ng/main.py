@@ -3,6 +3,11 @@ import os
 import sys
 from app.core import main_entry
 
+try:
+    import uvloop
+except ImportError:
+    uvloop = None
+
 if __name__ == "__main__":
     # Base path is current dir
     base_path = os.path.dirname(os.path.abspath(__file__))
@@ -15,6 +20,10 @@ if __name__ == "__main__":
     print(f"Starting Gatekeeper NG from {base_path}")
     print(f"Looking for legacy config in {legacy_path}")
     
+    # Faster drop-in event loop when available
+    if uvloop:
+        uvloop.install()
+
     try:
         asyncio.run(main_entry(base_path, legacy_path))
     except KeyboardInterrupt:
@@ -0,0 +1,150 @@
+import asyncio
+import os
+import socket
+import unittest
+from unittest import mock
+
+from app.ble_scanner import LE_META_FILTER, BLEScanner
+
+
+class LEMetaFilterTest(unittest.TestCase):
+    def test_matches_kernel_hci_ufilter_size(self):
+        # struct hci_ufilter is 16 bytes including trailing padding
+        self.assertEqual(len(LE_META_FILTER), 16)
+
+
+class HCISocketErrorTest(unittest.IsolatedAsyncioTestCase):
+    async def test_socket_error_removes_reader_and_wakes_scan_loop(self):
+        scanner = BLEScanner()
+        ours, theirs = socket.socketpair()
+        self.addCleanup(ours.close)
+        self.addCleanup(theirs.close)
+        loop = asyncio.get_running_loop()
+
+        sock = mock.Mock(fileno=ours.fileno, recv=mock.Mock(side_effect=OSError(19, "No such device")))
+        scanner.sock = sock
+        scanner.scanning = True
+        loop.add_reader(ours.fileno(), scanner._on_hci_readable)
+        theirs.send(b'x')
+
+        with self.assertLogs('BLEScanner', 'ERROR'):
+            await asyncio.wait_for(scanner._stopped.wait(), 1)
+        self.assertFalse(scanner.scanning)
+        self.assertEqual(sock.recv.call_count, 1)
+        # Already gone, so a second removal (scan_loop's finally) is a no-op
+        self.assertFalse(loop.remove_reader(ours.fileno()))
+
+
+ADDR = bytes([1, 2, 3, 4, 5, 6])  # little-endian on the wire
+UUID = bytes.fromhex('E2C56DB5DFFB48D2B060D0F5A71096E0')
+
+
+def adv_report(ad=b'', rssi=-60, addr=ADDR):
+    rep = bytes([1, 0, 0]) + addr + bytes([len(ad)]) + ad + bytes([rssi & 0xFF])
+    return bytes([0x04, 0x3E, len(rep) + 1, 0x02]) + rep
+
+
+def ibeacon_ad(major=b'\x01\x02', minor=b'\xFF\xFE'):
+    return bytes([0x1A, 0xFF, 0x4C, 0x00, 0x02, 0x15]) + UUID + major + minor + bytes([0xC5])
+
+
+def hcidump_frame(packet):
+    # hcidump -R: "> " then hex, wrapped at 20 bytes with indented continuations
+    rows = [' '.join(f'{b:02X}' for b in packet[i:i + 20]) for i in range(0, len(packet), 20)]
+    return ('> ' + '\n  '.join(rows) + ' \n').encode('ascii')
+
+
+class ScannerTestCase(unittest.IsolatedAsyncioTestCase):
+    async def asyncSetUp(self):
+        self.records = []
+        self.scanner = BLEScanner()
+        self.scanner.callback = self.records.append
+
+
+class ParseAdvertisingReportTest(ScannerTestCase):
+    async def test_mac_report(self):
+        name = b'Phone'
+        self.scanner.parse_hci_packet(adv_report(bytes([len(name) + 1, 0x09]) + name, rssi=-72))
+        self.assertEqual(self.records, [{
+            'mac': '06:05:04:03:02:01', 'identifier': '06:05:04:03:02:01',
+            'rssi': -72, 'name': 'Phone', 'extra': {},
+        }])
+        self.assertEqual(self.scanner.discovered_devices['06:05:04:03:02:01']['rssi'], -72)
+
+    async def test_ibeacon_report(self):
+        self.scanner.parse_hci_packet(adv_report(ibeacon_ad(), rssi=-5))
+        record, = self.records
+        self.assertEqual(record['mac'], '06:05:04:03:02:01')
+        self.assertEqual(record['identifier'], 'E2C56DB5-DFFB-48D2-B060-D0F5A71096E0')
+        self.assertEqual(record['rssi'], -5)
+        self.assertEqual(record['extra'], {'major': 258, 'minor': 65534})
+
+    async def test_ignores_other_events(self):
+        packet = bytearray(adv_report())
+        packet[3] = 0x01  # LE Connection Complete
+        self.scanner.parse_hci_packet(bytes(packet))
+        self.scanner.parse_hci_packet(b'\x04\x3E')
+        self.assertEqual(self.records, [])
+
+
+class ThrottleTest(ScannerTestCase):
+    def feed(self, *rssis):
+        for rssi in rssis:
+            self.scanner.parse_hci_packet(adv_report(rssi=rssi))
+        return [r['rssi'] for r in self.records]
+
+    async def test_repeats_within_interval_need_a_real_rssi_change(self):
+        self.scanner.min_adv_interval = 60
+        self.assertEqual(self.feed(-60, -61, -62, -70, -69), [-60, -70])
+
+    async def test_interval_elapsed_passes(self):
+        self.scanner.min_adv_interval = 60
+        self.feed(-60)
+        self.scanner.discovered_devices['06:05:04:03:02:01']['last_seen'] -= 61
+        self.assertEqual(self.feed(-60), [-60, -60])
+
+    async def test_other_macs_are_independent(self):
+        self.scanner.min_adv_interval = 60
+        self.feed(-60)
+        self.scanner.parse_hci_packet(adv_report(rssi=-60, addr=bytes(6)))
+        self.assertEqual(len(self.records), 2)
+
+    async def test_zero_interval_disables(self):
+        self.scanner.min_adv_interval = 0
+        self.assertEqual(self.feed(-60, -61, -60), [-60, -61, -60])
+
+
+class HcidumpWorkerTest(ScannerTestCase):
+    def run_worker(self, data):
+        r, w = os.pipe()
+        self.addCleanup(os.close, r)
+        with os.fdopen(w, 'wb') as f:
+            f.write(data)
+        self.scanner.proc = mock.Mock(**{'stdout.fileno.return_value': r})
+        self.scanner.scanning = True
+        self.scanner._worker()
+
+    async def test_multiline_frames(self):
+        name = b'A rather long device name'
+        packets = [adv_report(ibeacon_ad(), rssi=-50),
+                   adv_report(bytes([len(name) + 1, 0x09]) + name, rssi=-80, addr=bytes(6))]
+        # Command echoes ("< ") are framed but not advertising reports
+        data = (b'HCI sniffer - Bluetooth packet analyzer ver 5.66\ndevice: hci0 snap_len: 1500 filter: 0xffffffff\n'
+                + hcidump_frame(packets[0]) + b'< 01 0C 20 02 01 00 \n' + hcidump_frame(packets[1]))
+        self.assertGreater(len(packets[0]), 20)
+        self.run_worker(data)
+        self.assertEqual([(r['identifier'], r['rssi']) for r in self.records], [
+            ('E2C56DB5-DFFB-48D2-B060-D0F5A71096E0', -50),
+            ('00:00:00:00:00:00', -80),
+        ])
+        self.assertEqual(self.records[1]['name'], 'A rather long device name')
+
+    async def test_garbage_frame_does_not_stop_worker(self):
+        data = (hcidump_frame(adv_report(rssi=-40)) + b'> 04 3E \xff\xfe garbage\n'
+                + hcidump_frame(adv_report(rssi=-41, addr=bytes(6))) + b'> \x80')
+        self.run_worker(data)
+        self.assertEqual([r['rssi'] for r in self.records], [-40, -41])
+
+
+if __name__ == '__main__':
+    unittest.main()
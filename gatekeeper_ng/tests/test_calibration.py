@@ -0,0 +1,73 @@
+import random
+import statistics
+import unittest
+
+from admin.calibration import CalibrationSession
+
+
+def naive_trimmed_mean(values, proportion=0.1):
+    vals = sorted(values)
+    trim = max(1, int(len(vals) * proportion))
+    trimmed = vals[trim:-trim]
+    return statistics.fmean(trimmed) if trimmed else None
+
+
+class CalibrationSessionTest(unittest.TestCase):
+    def setUp(self):
+        self.rng = random.Random(1234)
+
+    def feed(self, session, count):
+        readings = [self.rng.randint(-95, -35) for _ in range(count)]
+        for rssi in readings:
+            session.add(rssi)
+        return readings
+
+    def test_window_stdev_matches_statistics_across_rollover(self):
+        session = CalibrationSession(0)
+        readings = []
+        for _ in range(100):
+            rssi = self.rng.randint(-95, -35)
+            session.add(rssi)
+            readings.append(rssi)
+            window = readings[-30:]
+            self.assertEqual(session.window_full(), len(window) == 30)
+            if len(window) >= 2:
+                self.assertAlmostEqual(session.window_stdev(), statistics.stdev(window), places=9)
+
+    def test_window_stdev_of_constant_signal_is_zero(self):
+        session = CalibrationSession(0)
+        for _ in range(40):
+            session.add(-60)
+        self.assertEqual(session.window_stdev(), 0.0)
+
+    def test_trimmed_mean_and_mean_match_naive(self):
+        session = CalibrationSession(0)
+        readings = []
+        for n in (1, 5, 10, 11, 30, 200):
+            readings += self.feed(session, n - len(readings))
+            self.assertEqual(session.count, len(readings))
+            self.assertAlmostEqual(session.mean(), statistics.fmean(readings))
+            expected = naive_trimmed_mean(readings)
+            if expected is None:
+                self.assertIsNone(session.trimmed_mean())
+            else:
+                self.assertAlmostEqual(session.trimmed_mean(), expected)
+
+    def test_readings_are_capped(self):
+        for cap in (16, 512):
+            session = CalibrationSession(0, max_readings=cap)
+            readings = self.feed(session, cap * 3 + 7)
+            kept = readings[-cap:]
+            self.assertEqual(session.count, cap)
+            self.assertEqual(list(session.sorted_readings), sorted(kept))
+            self.assertAlmostEqual(session.mean(), statistics.fmean(kept))
+            self.assertAlmostEqual(session.trimmed_mean(), naive_trimmed_mean(kept))
+
+    def test_default_cap(self):
+        session = CalibrationSession(0)
+        self.feed(session, 600)
+        self.assertEqual(session.count, 512)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,123 @@
+import json
+import os
+import tempfile
+import unittest
+from unittest import mock
+
+from app import config_mgr
+from app.config_mgr import ConfigManager
+
+
+class ConfigManagerTest(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.mgr = ConfigManager(self.tmp.name)
+
+    def tearDown(self):
+        with self.mgr._flush_lock:
+            if self.mgr._flush_timer:
+                self.mgr._flush_timer.cancel()
+            self.mgr._pending.clear()
+        self.tmp.cleanup()
+
+    def write_json(self, path, data):
+        with open(path, 'w') as f:
+            json.dump(data, f)
+
+    def read_json(self, path):
+        with open(path) as f:
+            return json.load(f)
+
+    def seed_devices(self):
+        devices = [{'identifier': 'AA:BB:CC:DD:EE:FF', 'identifier_type': 'mac', 'alias': 'Phone'}]
+        self.write_json(self.mgr.devices_file, devices)
+        return devices
+
+    def test_deferred_save_visible_before_flush(self):
+        on_disk = self.seed_devices()
+        stamp = self.mgr.file_stamp(self.mgr.devices_file)
+
+        self.mgr.save_devices(on_disk + [{'identifier': 'aa:00', 'alias': 'Tag'}])
+
+        # Served from memory, normalized, while the file is untouched
+        ids = [d['identifier'] for d in self.mgr.load_devices()]
+        self.assertEqual(ids, ['AA:BB:CC:DD:EE:FF', 'AA:00'])
+        self.assertIn('AA:00', self.mgr.known_identifiers())
+        self.assertNotEqual(self.mgr.file_stamp(self.mgr.devices_file), stamp)
+        self.assertEqual(self.read_json(self.mgr.devices_file), on_disk)
+
+    def test_flush_persists(self):
+        self.seed_devices()
+        self.mgr.save_devices([{'identifier': 'aa:00', 'alias': 'Tag'}])
+        self.assertTrue(self.mgr.flush())
+
+        self.assertEqual(self.mgr._pending, {})
+        self.assertEqual(self.read_json(self.mgr.devices_file),
+                         [{'identifier': 'AA:00', 'alias': 'Tag', 'identifier_type': 'mac'}])
+        st = os.stat(self.mgr.devices_file)
+        self.assertEqual(self.mgr.file_stamp(self.mgr.devices_file), (st.st_mtime_ns, st.st_size))
+        self.assertEqual([f for f in os.listdir(self.mgr.config_dir) if f.endswith('.tmp')], [])
+
+    def test_write_through_cache_skips_reread(self):
+        self.mgr.save_settings({'PREF_BEACON_EXPIRATION': '90'})
+        with mock.patch('builtins.open', side_effect=AssertionError("re-read")):
+            self.assertEqual(self.mgr.load_settings()['PREF_BEACON_EXPIRATION'], '90')
+
+    def test_external_edit_is_reloaded(self):
+        self.mgr.save_settings({'PREF_BEACON_EXPIRATION': '90'})
+        self.write_json(self.mgr.settings_file, {'PREF_BEACON_EXPIRATION': '120', 'extra': 'padding'})
+        self.assertEqual(self.mgr.load_settings()['PREF_BEACON_EXPIRATION'], '120')
+
+    def test_legacy_mac_entries_are_migrated_and_uppercased(self):
+        self.write_json(self.mgr.devices_file, [
+            {'mac': 'aa:bb:cc:dd:ee:ff', 'alias': 'Old'},
+            {'identifier': ' e2c56db5-dffb-48d2-b060-d0f5a71096e0 ', 'identifier_type': 'uuid', 'alias': 'Beacon'},
+        ])
+        devices = self.mgr.load_devices()
+        self.assertEqual(devices[0], {'identifier': 'AA:BB:CC:DD:EE:FF', 'identifier_type': 'mac', 'alias': 'Old'})
+        self.assertEqual(devices[1]['identifier'], 'E2C56DB5-DFFB-48D2-B060-D0F5A71096E0')
+        self.assertEqual(devices[1]['identifier_type'], 'uuid')
+
+    def test_legacy_known_static_addresses_migration(self):
+        legacy = tempfile.TemporaryDirectory()
+        self.addCleanup(legacy.cleanup)
+        os.makedirs(os.path.join(legacy.name, 'monitor'))
+        with open(os.path.join(legacy.name, 'monitor', 'known_static_addresses'), 'w') as f:
+            f.write("# comment\naa:bb:cc:dd:ee:ff Phone #Phone\n11:22:33:44:55:66\n")
+        mgr = ConfigManager(self.tmp.name, legacy_path=legacy.name)
+        self.assertEqual(mgr.load_devices(), [
+            {'identifier': 'AA:BB:CC:DD:EE:FF', 'identifier_type': 'mac', 'alias': 'Phone', 'type': 'Phone'},
+            {'identifier': '11:22:33:44:55:66', 'identifier_type': 'mac', 'alias': '11:22:33:44:55:66', 'type': 'Bluetooth'},
+        ])
+
+    def test_failed_flush_keeps_pending_and_retries(self):
+        on_disk = self.seed_devices()
+        self.mgr.save_devices([{'identifier': 'aa:00', 'alias': 'Tag'}])
+
+        with mock.patch.object(config_mgr.os, 'replace', side_effect=OSError(28, "No space left on device")), \
+                self.assertLogs('ConfigMgr', 'ERROR'):
+            self.assertFalse(self.mgr.flush())
+
+        # Nothing lost: still pending, still served, retry armed, file untouched
+        self.assertIn(self.mgr.devices_file, self.mgr._pending)
+        self.assertEqual([d['identifier'] for d in self.mgr.load_devices()], ['AA:00'])
+        self.assertEqual(len(self.mgr.file_stamp(self.mgr.devices_file)), 3)
+        self.assertIsNotNone(self.mgr._flush_timer)
+        self.assertEqual(self.read_json(self.mgr.devices_file), on_disk)
+        self.assertEqual([f for f in os.listdir(self.mgr.config_dir) if f.endswith('.tmp')], [])
+
+        self.assertTrue(self.mgr.flush())
+        self.assertEqual(self.read_json(self.mgr.devices_file)[0]['identifier'], 'AA:00')
+
+    def test_failed_flush_at_exit_is_logged(self):
+        self.seed_devices()
+        self.mgr.save_devices([{'identifier': 'aa:00', 'alias': 'Tag'}])
+        with mock.patch.object(config_mgr.os, 'replace', side_effect=OSError(30, "Read-only file system")), \
+                self.assertLogs('ConfigMgr', 'CRITICAL') as logs:
+            self.mgr._flush_at_exit()
+        self.assertTrue(any(self.mgr.devices_file in line for line in logs.output))
+        self.assertIsNone(self.mgr._flush_timer)
+
+
+if __name__ == '__main__':
+    unittest.main()
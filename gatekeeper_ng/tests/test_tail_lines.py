@@ -0,0 +1,87 @@
+import os
+import random
+import tempfile
+import unittest
+
+from admin.server import _tail_lines
+
+
+def naive_tail(path, count, exclude=None):
+    with open(path, 'r', encoding='utf-8', errors='replace', newline='') as f:
+        lines = [line.rstrip('\n') for line in f.readlines()]
+    if exclude:
+        lines = [line for line in lines if exclude not in line]
+    return lines[-count:]
+
+
+class TailLinesTest(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.tmp.name, 'gatekeeper.log')
+        self.rng = random.Random(42)
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def write(self, data):
+        with open(self.path, 'wb') as f:
+            f.write(data)
+
+    def check(self, count=200, exclude="[werkzeug]", chunk_size=64 * 1024):
+        self.assertEqual(_tail_lines(self.path, count, exclude=exclude, chunk_size=chunk_size),
+                         naive_tail(self.path, count, exclude))
+
+    def log_lines(self, n):
+        lines = []
+        for i in range(n):
+            name = "[werkzeug]" if self.rng.random() < 0.3 else "[Tracker]"
+            lines.append(f"2026-01-01 00:00:{i % 60:02d} {name} INFO: line {i} " + "x" * self.rng.randint(0, 300))
+        return lines
+
+    def test_line_split_across_chunk_boundary(self):
+        chunk = 64 * 1024
+        long_line = b"[Tracker] straddles " + b"b" * 100 + b"\n"
+        # Lines after long_line fill one chunk minus 50 bytes, so the first
+        # chunk boundary (counted from the end) falls inside long_line
+        tail = b""
+        i = 0
+        while len(tail) < chunk - 50:
+            tail += b"[Tracker] tail %d\n" % i
+            i += 1
+        tail = tail[:chunk - 50 - 1] + b"\n"
+        data = b"[Tracker] head\n" + long_line + tail
+        start = len(data) - chunk
+        self.assertTrue(len(data) - len(tail) - len(long_line) < start < len(data) - len(tail))
+        self.write(data)
+        self.check(count=5000)
+        self.check(count=5000, chunk_size=chunk - 10)
+
+    def test_many_chunks_with_werkzeug_filtering(self):
+        self.write(("\n".join(self.log_lines(3000)) + "\n").encode())
+        self.check()
+        self.check(exclude=None)
+        self.check(chunk_size=97)
+
+    def test_no_trailing_newline(self):
+        self.write("\n".join(self.log_lines(500)).encode())
+        self.check()
+        self.check(chunk_size=64)
+
+    def test_shorter_than_one_chunk(self):
+        self.write(b"[Tracker] one\n[werkzeug] GET /\n[Tracker] two\n")
+        self.check()
+        self.check(count=1)
+
+    def test_blank_lines_and_empty_file(self):
+        self.write(b"\n\n[Tracker] a\n\n")
+        self.check()
+        self.write(b"")
+        self.check()
+
+    def test_all_lines_filtered(self):
+        self.write(b"[werkzeug] a\n[werkzeug] b\n" * 5000)
+        self.check()
+
+
+if __name__ == '__main__':
+    unittest.main()